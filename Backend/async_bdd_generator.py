@@ -0,0 +1,403 @@
+"""
+An asyncio server for the /generate-data flow. Confluence is called over non-blocking HTTP, so a request waiting on
+Confluence holds no thread, and parsing and code generation run in a pool of worker processes so they never block the
+event loop. Requests, responses and error messages are the same as the Flask backend's:
+
+    python async_bdd_generator.py
+    gunicorn async_bdd_generator:create_app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:8003
+"""
+import asyncio
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+import compression
+import errors
+import metrics
+from bdd_generator import (HANDLED_ERRORS, Catch2CodeGenerator, ErrorFormatter, ScenarioGetter, check_proxy_env,
+                           check_results_page, check_scenarios_found, create_scenario_store, get_cache_stats,
+                           get_mock_page, get_next_offset, get_remaining_offsets, join_parsed_pages, keep_scenarios,
+                           load_config, read_stored_scenarios)
+from mock_data import MOCK_REQUIREMENTS
+from scenario_cache import ScenarioCache
+
+# Statuses retried with backoff, as ScenarioGetter's session does
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Set in each worker process by init_worker, so each worker creates its generator once rather than per request
+worker_generator = None
+
+
+def init_worker():
+    global worker_generator
+    worker_generator = Catch2CodeGenerator()
+
+
+def generate(operation, scenarios, file_text=None, diff=False):
+    """
+    Generates the code for an operation. Runs in the worker processes
+
+    Parameters:
+        operation (str): either "new" or "update"
+        scenarios (list): scenarios from AsyncScenarioGetter.get_requirements
+        file_text (str): the existing file, for updates
+        diff (bool): whether to return an update's changes rather than the updated file
+
+    Returns:
+        str, or dict for an update with diff
+    """
+    if operation == "new":
+        return worker_generator.generate_new_scenarios(scenarios)
+    elif diff:
+        return worker_generator.diff_existing_scenarios(scenarios, file_text or "")
+    return worker_generator.update_existing_scenarios(scenarios, file_text or "")[0]
+
+
+class AsyncScenarioGetter():
+    """
+    The non-blocking counterpart of ScenarioGetter. Confluence's REST API is called through one aiohttp session, and
+    a page's ID and version come from a single content query, as in ScenarioGetter.get_page. Scenarios are cached and
+    stored per page version like ScenarioGetter's, and the same errors are raised
+    """
+
+    def __init__(self, executor):
+        config_data = load_config('Credentials.yaml')
+        settings = load_config('Settings.yaml')
+
+        confluence_settings = settings.get("confluence", {})
+        self._url = config_data["url"].rstrip("/")
+        self._auth = aiohttp.BasicAuth(config_data["username"], config_data["password"])
+        self._use_mock_data = confluence_settings.get("use_mock_data", True)
+        self._timeout = aiohttp.ClientTimeout(total=confluence_settings.get("timeout", 10))
+        self._retries = confluence_settings.get("retries", 3)
+        self._backoff_factor = confluence_settings.get("backoff_factor", 0.5)
+        self._page_limit = confluence_settings.get("page_limit", 200)
+        self._page_concurrency = confluence_settings.get("page_concurrency", 4)
+        # Many more requests wait on Confluence at once than with a thread per request, so the pool is sized separately
+        self._connection_limit = settings.get("async", {}).get("connection_limit", 100)
+        self._session = None
+
+        # Parsing runs in the executor, off the event loop
+        self._executor = executor
+
+        cache_settings = settings.get("cache", {})
+        self._cache = ScenarioCache(cache_settings.get("max_entries", 128), cache_settings.get("ttl", 300))
+        # (space, page) -> the task loading the page, shared by concurrent requests for it
+        self._in_flight = {}
+        self.shared = 0
+
+        self._store = create_scenario_store(settings.get("store", {}))
+
+    async def start(self):
+        # The session must be created on the running event loop
+        connector = aiohttp.TCPConnector(limit=self._connection_limit)
+        self._session = aiohttp.ClientSession(auth=self._auth, timeout=self._timeout, connector=connector)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def get_json(self, call, path, params):
+        """
+        Makes a GET request to Confluence, retrying with backoff after a 429 or 5xx status or a connection failure,
+        and returns the response's status and, if it succeeded, its JSON body
+
+        Parameters:
+            call (str): names the call in the Confluence request metrics
+            path (str): the path of the REST endpoint
+            params (dict): the query parameters
+
+        Returns:
+            tuple
+        """
+        for attempt in range(self._retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff_factor * 2 ** (attempt - 1))
+            try:
+                with metrics.CONFLUENCE_REQUEST_SECONDS.time(call=call):
+                    async with self._session.get(self._url + path, params=params,
+                                                 headers={"Accept": "application/json"}) as response:
+                        if response.status in RETRY_STATUSES and attempt < self._retries:
+                            continue
+                        if response.status >= 400:
+                            return response.status, None
+                        return response.status, await response.json(content_type=None)
+            except ValueError:
+                raise errors.ConfluenceError
+            # Connection failures and timeouts
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self._retries:
+                    raise errors.ConfluenceError
+
+    async def get_page(self, space, page):
+        """
+        Takes a Confluence space key and page name and returns the page's ID and current version number
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+
+        Returns:
+            tuple
+        """
+        params = {"spaceKey": space, "title": page, "type": "page", "expand": "version"}
+        status, page_data = await self.get_json("page", "/rest/api/content", params)
+        if status == 401:
+            raise errors.CredentialsError
+        # Confluence returns a 404 for spaces the user cannot access, which ScenarioGetter sees as ApiPermissionError
+        elif status == 404:
+            raise errors.InvalidSpaceError
+        elif status >= 400:
+            raise errors.ConfluenceError
+
+        if not isinstance(page_data, dict):
+            raise errors.ConfluenceError
+        results = page_data.get("results")
+        if not results:
+            raise errors.PageNotFoundError
+        try:
+            return results[0]["id"], results[0]["version"]["number"]
+        except (KeyError, TypeError):
+            raise errors.ConfluenceError
+
+    async def get_requirements_page(self, space, page_id, offset):
+        """
+        Takes a Confluence space key, page ID and result offset and returns one page of Requirements Yogi results
+        for the Confluence page. "results" holds the requirements and "count" the total number of requirements
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page_id (str): the ID of a Confluence page
+            offset (int): the index of the first requirement to return
+
+        Returns:
+            dict
+        """
+        params = {
+            "spaceKey": space,
+            "q": "page = " + str(page_id),
+            "offset": str(offset),
+            "limit": str(self._page_limit)
+        }
+        status, results_page = await self.get_json("requirements", "/rest/reqs/1/requirement2/" + space, params)
+        if status == 401:
+            raise errors.CredentialsError
+        elif status >= 400:
+            raise errors.ConfluenceError
+        return check_results_page(results_page)
+
+    async def parse_results_page(self, results):
+        with metrics.STAGE_SECONDS.time(stage="parse"):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, ScenarioGetter.parse_response_data, results)
+
+    async def get_page_scenarios(self, space, page_id):
+        """
+        Takes a Confluence space key and page ID and returns the parsed scenarios of every requirement on the page.
+        Once the first page of results gives the total, the remaining pages are requested concurrently, up to
+        page_concurrency at a time, and each is parsed as soon as it arrives
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page_id (str): the ID of a Confluence page
+
+        Returns:
+            list
+        """
+        first_page = await self.get_requirements_page(space, page_id, 0)
+        parsed_pages = {0: await self.parse_results_page(first_page["results"])}
+        offsets = get_remaining_offsets(first_page)
+
+        if offsets is not None:
+            semaphore = asyncio.Semaphore(self._page_concurrency)
+
+            async def load(offset):
+                async with semaphore:
+                    results = (await self.get_requirements_page(space, page_id, offset))["results"]
+                parsed_pages[offset] = await self.parse_results_page(results)
+
+            tasks = [asyncio.ensure_future(load(offset)) for offset in offsets]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+        else:
+            page_size = len(first_page["results"])
+            offset = get_next_offset(0, first_page["results"], page_size)
+            while offset is not None:
+                results = (await self.get_requirements_page(space, page_id, offset))["results"]
+                parsed_pages[offset] = await self.parse_results_page(results)
+                offset = get_next_offset(offset, results, page_size)
+
+        return join_parsed_pages(parsed_pages)
+
+    async def get_requirements(self, space, page):
+        """
+        Takes a Confluence space key and page name and, if found, returns a list of all BDD scenarios
+        stored on the page. Scenarios are served from the cache while the page version is unchanged
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+
+        Returns:
+            list
+        """
+
+        check_proxy_env()
+
+        # Concurrent requests for the same page share one load. It is shielded so that a client disconnecting does
+        # not cancel it for the others
+        key = (space, page)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self.load_requirements(space, page))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    async def load_requirements(self, space, page):
+        if self._use_mock_data:
+            page_id, version = get_mock_page()
+        else:
+            page_id, version = await self.get_page(space, page)
+
+        # The store is read and written in the default thread pool, off the event loop
+        loop = asyncio.get_running_loop()
+        cache_key = (space, page, version)
+        scenario_data = self._cache.get(cache_key)
+        if scenario_data is None and self._store is not None:
+            scenario_data = await loop.run_in_executor(None, read_stored_scenarios, self._cache, self._store, cache_key)
+        if scenario_data is None:
+            scenario_data = await self.fetch_requirements(space, page_id)
+            await loop.run_in_executor(None, keep_scenarios, self._cache, self._store, cache_key, scenario_data)
+        return scenario_data
+
+    async def fetch_requirements(self, space, page_id):
+        if self._use_mock_data:
+            return check_scenarios_found(await self.parse_results_page(MOCK_REQUIREMENTS))
+        return check_scenarios_found(await self.get_page_scenarios(space, page_id))
+
+    def cache_stats(self):
+        return get_cache_stats(self._cache, self._store, self.shared)
+
+
+async def read_params(request):
+    """
+    Returns the parameters of a request: the JSON body of a POST, or the query string of a GET. aiohttp decompresses
+    gzip request bodies itself
+
+    Parameters:
+        request (aiohttp.web.Request): the request being handled
+
+    Returns:
+        dict
+    """
+    if request.method != "POST":
+        return dict(request.query)
+    try:
+        data = json.loads(await request.read() or b"{}")
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body is not valid JSON")
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    return data
+
+
+def make_response(request, body):
+    """
+    Returns a dict as JSON and a string as HTML, as Flask does, gzip compressed for clients that accept it when at
+    least compression.min_size bytes
+    """
+    if isinstance(body, dict):
+        response = web.json_response(body)
+    else:
+        response = web.Response(text=body, content_type="text/html")
+
+    compression_settings = request.app["settings"].get("compression", {})
+    if compression_settings.get("enabled", True) and "gzip" in request.headers.get("Accept-Encoding", "").lower() \
+            and len(response.body) >= compression_settings.get("min_size", 1024):
+        response.enable_compression(web.ContentCoding.gzip)
+    return response
+
+
+async def generate_data(request):
+    """
+    Generates the code for a page, as the Flask backend's /generate-data does. With response=diff, an update returns
+    the changes to file_text as JSON, and errors are returned under "error"
+    """
+    params = await read_params(request)
+    operation = params.get("operation")
+    metrics.OPERATIONS.inc(operation=metrics.operation_label(operation))
+    diff_response = params.get("response") == "diff"
+    ef = request.app["error_formatter"]
+    try:
+        with metrics.STAGE_SECONDS.time(stage="fetch"):
+            data = await request.app["scenario_getter"].get_requirements(params.get("space"), params.get("page"))
+        if operation not in ("new", "update"):
+            response = ef.generate_generic_error()
+        else:
+            with metrics.STAGE_SECONDS.time(stage="generate" if operation == "new" else "update"):
+                response = await asyncio.get_running_loop().run_in_executor(
+                    request.app["executor"], generate, operation, data, params.get("file_text"), diff_response)
+    except HANDLED_ERRORS as e:
+        metrics.ERRORS.inc(type=type(e).__name__)
+        response = ef.generate_exception_error(e)
+        if diff_response:
+            response = {"error": response}
+    return make_response(request, response)
+
+
+async def cache_stats(request):
+    return web.json_response(request.app["scenario_getter"].cache_stats())
+
+
+async def get_metrics(request):
+    cache_stats = metrics.format_gauges("bdd_generator_cache", "Scenario cache statistics",
+                                         request.app["scenario_getter"].cache_stats())
+    return web.Response(text=metrics.render(cache_stats), content_type="text/plain")
+
+
+async def start_app(app):
+    # Workers are spawned rather than forked, so they do not inherit the event loop or the parent's open connections
+    app["executor"] = ProcessPoolExecutor(max_workers=app["settings"].get("async", {}).get("workers"),
+                                          mp_context=multiprocessing.get_context("spawn"), initializer=init_worker)
+    app["scenario_getter"] = AsyncScenarioGetter(app["executor"])
+    await app["scenario_getter"].start()
+
+
+async def stop_app(app):
+    await app["scenario_getter"].close()
+    app["executor"].shutdown(wait=False)
+
+
+def create_app():
+    """
+    Creates the app. The process pool and the AsyncScenarioGetter are created once the event loop is running
+
+    Returns:
+        aiohttp.web.Application
+    """
+    settings = load_config('Settings.yaml')
+    # Updates post whole source files, so bodies may be larger than aiohttp's 1MB default. aiohttp applies the limit
+    # to bodies once they are decompressed
+    app = web.Application(client_max_size=compression.get_max_body_size(settings.get("compression", {})))
+    app["settings"] = settings
+    app["error_formatter"] = ErrorFormatter()
+    app.router.add_route("GET", "/generate-data", generate_data)
+    app.router.add_route("POST", "/generate-data", generate_data)
+    app.router.add_get("/cache-stats", cache_stats)
+    app.router.add_get("/metrics", get_metrics)
+    app.on_startup.append(start_app)
+    app.on_cleanup.append(stop_app)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host="0.0.0.0", port=load_config('Settings.yaml').get("async", {}).get("port", 8003))
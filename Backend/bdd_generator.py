@@ -1,59 +1,778 @@
-import atlassian.errors
 import requests
-from atlassian import Confluence
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import yaml
 import abc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import re
 import os
+import multiprocessing
+import threading
 import errors
-from enum import Enum
-from flask import Flask, request
+import jobs
+import compression
+import metrics
+import patches
+import webhooks
+from mock_data import MOCK_REQUIREMENTS
+from scenario_cache import ScenarioCache, SingleFlight
+from scenario_store import ScenarioStore
+from catch2_parser import Catch2Parser
+from scenario_model import Scenario, Statement
+from profiling import RequestProfiler
+from flask import Flask, Response, request, stream_with_context
 from unicodedata import normalize
 import json
 
 app = Flask(__name__)
 
-@app.route('/generate-data', methods=['GET'])
+# Errors reported to the user through ErrorFormatter rather than as a server error
+HANDLED_ERRORS = (
+    errors.PageNotFoundError,
+    errors.CredentialsError,
+    errors.ConfluenceError,
+    errors.InvalidSpaceError,
+    errors.ScenariosNotFoundError,
+    errors.ScenarioStatementsMissingError,
+    errors.ProxyEnvError,
+    FileExistsError
+)
+
+batch_executors = None
+batch_executors_lock = threading.Lock()
+
+# Created by create_app, or on first use for the ScenarioGetter
+sg = None
+sg_lock = threading.Lock()
+cg = None
+ef = None
+profiler = None
+compressor = None
+job_manager = None
+refresh_manager = None
+rendered_cache = None
+webhook_settings = None
+metrics_store = None
+
+# Patterns used to parse Requirements Yogi statements, compiled once
+BDD_KEYWORDS_REGEX = "SCENARIO|GIVEN|WHEN|THEN|AND_GIVEN|AND_WHEN|AND_THEN"
+BDD_KEYWORDS_PATTERN = re.compile(BDD_KEYWORDS_REGEX)
+STATEMENT_TEXT_PATTERN = re.compile(r"\(.*?\)")
+SIMPLE_STATEMENT_PATTERN = re.compile("(" + BDD_KEYWORDS_REGEX + r")\(([^()\n]*)\)[^()]*\Z")
+BDD_TYPES = {x: x.title() for x in BDD_KEYWORDS_REGEX.split("|")}
+
+# The version of the scenarios parse_response_data returns. Bump it when a change to the parser changes them, so that
+# scenarios kept in the ScenarioStore by an earlier version are fetched and parsed again
+PARSER_VERSION = 1
+
+# The version of the code Catch2CodeGenerator generates. Bump it when a change to the generator changes its output, so
+# that code kept in the ScenarioStore by an earlier version is generated again
+GENERATOR_VERSION = 1
+
+def create_scenario_store(store_settings):
+    """
+    Takes the store section of Settings.yaml and opens the ScenarioStore it describes
+
+    Parameters:
+        store_settings (dict): the store settings
+
+    Returns:
+        ScenarioStore, or None if the store is not enabled
+    """
+    if not store_settings.get("enabled", False):
+        return None
+    store_path = os.path.join(os.path.dirname(__file__), store_settings.get("path", "scenarios.db"))
+    return ScenarioStore(store_path, int(store_settings.get("max_megabytes", 256) * 1024 * 1024), PARSER_VERSION,
+                         GENERATOR_VERSION)
+
+def check_results_page(results_page):
+    """
+    Takes a page of Requirements Yogi results and returns it, or raises ConfluenceError if it does not hold a list
+    of "results", as when Confluence answers with something other than the Requirements Yogi API
+
+    Returns:
+        dict
+    """
+    if not isinstance(results_page, dict) or not isinstance(results_page.get("results"), list):
+        raise errors.ConfluenceError
+    return results_page
+
+# The helpers below hold what ScenarioGetter and AsyncScenarioGetter share, so that the getters differ only in how
+# they make requests
+
+def check_proxy_env():
+    """
+    Raises ProxyEnvError if a proxy is set in the environment, as the Confluence requests cannot go through one
+    """
+    if os.environ.get("HTTP_PROXY") or os.environ.get("HTTPS_PROXY"):
+        raise errors.ProxyEnvError
+
+def get_mock_page():
+    """
+    Returns the page ID and version used in place of a Confluence page's while mock data is served. Mock data never
+    changes, so it is always the first version
+
+    Returns:
+        tuple: (page ID, version)
+    """
+    return None, 1
+
+def get_remaining_offsets(first_page):
+    """
+    Takes the first page of Requirements Yogi results for a Confluence page and returns the offsets of the other
+    pages, which can be requested at once, or None if the total is not given. Pages must then be requested one after
+    another, see get_next_offset
+
+    Parameters:
+        first_page (dict): the results page at offset 0
+
+    Returns:
+        range
+    """
+    page_size = len(first_page["results"])
+    total = first_page.get("count")
+    if not page_size or total is None:
+        return None
+    return range(page_size, total, page_size)
+
+def get_next_offset(offset, results, page_size):
+    """
+    Takes the offset and results of a page of Requirements Yogi results requested without knowing the total, and
+    returns the offset of the next page, or None once a page comes back short
+
+    Parameters:
+        offset (int): the offset the results were requested at
+        results (list): the page's results
+        page_size (int): the number of results on the first page
+
+    Returns:
+        int
+    """
+    if not results or len(results) != page_size:
+        return None
+    return offset + len(results)
+
+def join_parsed_pages(parsed_pages):
+    """
+    Takes the scenarios parsed from each page of results, keyed by offset, and returns them all in page order
+
+    Returns:
+        list
+    """
+    return [scenario for offset in sorted(parsed_pages) for scenario in parsed_pages[offset]]
+
+def check_scenarios_found(scenario_data):
+    """
+    Returns the scenarios parsed for a page, or raises ScenariosNotFoundError if there are none
+
+    Returns:
+        list
+    """
+    if len(scenario_data) == 0:
+        raise errors.ScenariosNotFoundError
+    return scenario_data
+
+def read_stored_scenarios(cache, store, cache_key):
+    """
+    Returns the scenarios kept in the ScenarioStore for a page version, putting them in the cache, or None if they
+    are not stored. Called after a cache miss
+
+    Parameters:
+        cache (ScenarioCache): the getter's cache
+        store (ScenarioStore): the getter's store, or None if it is not enabled
+        cache_key (tuple): (space, page, version)
+
+    Returns:
+        list
+    """
+    if store is None:
+        return None
+    scenario_data = store.get(*cache_key)
+    if scenario_data is not None:
+        cache.put(cache_key, scenario_data)
+    return scenario_data
+
+def keep_scenarios(cache, store, cache_key, scenario_data):
+    """
+    Keeps the scenarios fetched for a page version in the cache and, when it is enabled, the ScenarioStore
+
+    Parameters:
+        cache (ScenarioCache): the getter's cache
+        store (ScenarioStore): the getter's store, or None if it is not enabled
+        cache_key (tuple): (space, page, version)
+        scenario_data (list): the page's scenarios
+    """
+    cache.put(cache_key, scenario_data)
+    if store is not None:
+        store.put(*cache_key, scenario_data)
+
+def get_cache_stats(cache, store, coalesced):
+    """
+    Returns a getter's cache statistics, with the number of requests that shared another's load and, when the
+    ScenarioStore is enabled, its statistics prefixed with "store_"
+
+    Returns:
+        dict
+    """
+    stats = cache.stats()
+    stats["coalesced"] = coalesced
+    if store is not None:
+        stats.update({"store_" + key: value for key, value in store.stats().items()})
+    return stats
+
+
+@app.route('/generate-data', methods=['GET', 'POST'])
 def generate_data():
+    """
+    Generates the code for a page. Parameters are taken from the JSON body of a POST, which may be gzip compressed,
+    or from the query string of a GET. With response=diff, an update returns the changes to file_text as JSON
+    rather than the whole updated file (see Catch2CodeGenerator.diff_existing_scenarios), and errors are returned
+    under "error"
+    """
+    params = get_request_params()
+    metrics.OPERATIONS.inc(operation=metrics.operation_label(params.get("operation")))
+    diff_response = params.get("response") == "diff"
+    profile = profiler.start(request)
+    data = None
     try:
-        data = sg.get_requirements(request.args.get("space"), request.args.get("page"))
+        with metrics.STAGE_SECONDS.time(stage="fetch"):
+            version, data = get_scenario_getter().get_versioned_requirements(params.get("space"), params.get("page"))
         if data is None:
             response = ef.generate_generic_error()
         else:
-            if request.args.get("operation") == "new":
-                response = cg.generate_new_scenarios(data)
-            elif request.args.get("operation") == "update":
-                response = cg.update_existing_scenarios(data, request.args.get("file_text"))[0]
-    except errors.PageNotFoundError:
-        response = ef.generate_page_not_found_error()
-    except errors.CredentialsError:
-        response = ef.generate_credentials_error()
-    except errors.ConfluenceError:
-        response = ef.generate_confluence_error()
-    except errors.InvalidSpaceError:
-        response = ef.generate_invalid_space_error()
-    except errors.ScenariosNotFoundError:
-        response = ef.generate_no_scenarios_error()
-    except errors.ScenarioStatementsMissingError:
-        response = ef.generate_missing_statement_error()
-    except errors.ProxyEnvError:
-        response = ef.generate_proxy_env_error()
-    except FileExistsError:
-        response = ef.generate_error_string("File already exists")
+            if params.get("operation") == "new":
+                rendered = get_rendered(params.get("space"), params.get("page"), version)
+                # Pages refreshed by a webhook event have their code generated before it is requested
+                if rendered is not None:
+                    response = rendered
+                # Profiled requests are generated in full so the generation is part of the profile
+                elif profile is not None:
+                    response = cg.generate_new_scenarios(data)
+                else:
+                    # Stream the generated code back one scenario at a time rather than building the whole file first
+                    scenario_blocks = metrics.STAGE_SECONDS.time_iterable(cg.iter_new_scenarios(data), stage="generate")
+                    response = Response(stream_with_context(scenario_blocks))
+            elif params.get("operation") == "update":
+                with metrics.STAGE_SECONDS.time(stage="update"):
+                    if diff_response:
+                        response = cg.diff_existing_scenarios(data, params.get("file_text") or "")
+                    else:
+                        response = cg.update_existing_scenarios(data, params.get("file_text"))[0]
+    except HANDLED_ERRORS as e:
+        metrics.ERRORS.inc(type=type(e).__name__)
+        response = ef.generate_exception_error(e)
+    finally:
+        if profile is not None:
+            profiler.save(profile, {
+                "space": params.get("space"),
+                "page": params.get("page"),
+                "operation": params.get("operation"),
+                "file_text": params.get("file_text"),
+                "scenarios": [x.to_dict() for x in data] if data is not None else None
+            })
+    if diff_response and isinstance(response, str):
+        response = {"error": response}
     return response
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns the metrics in the Prometheus text format. When a metrics directory is configured they cover every worker
+    process of the server, otherwise only the process that handles the request
+    """
+    get_scenario_getter()
+    gauges = collect_gauges()
+    if metrics_store is not None:
+        text = metrics_store.render(gauges)
+    else:
+        text = metrics.render([line for gauge in gauges for line in metrics.format_gauges(*gauge)])
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+def collect_gauges():
+    """
+    Returns the process's cache and job statistics as (name, documentation, values) for metrics.format_gauges
+
+    Returns:
+        list
+    """
+    gauges = []
+    # The ScenarioGetter is only created once a request needs it
+    if sg is not None:
+        gauges.append(("bdd_generator_cache", "Scenario cache statistics", sg.cache_stats()))
+    gauges.append(("bdd_generator_jobs", "Background jobs by state", job_manager.stats()))
+    gauges.append(("bdd_generator_refresh_jobs", "Webhook refresh jobs by state", refresh_manager.stats()))
+    gauges.append(("bdd_generator_rendered", "Code generated ahead of requests by webhook events",
+                   rendered_cache.stats()))
+    return gauges
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queues a /generate-data request to run in the background, taking the same parameters, and returns the job's
+    status with a 202. Poll /jobs/<id> until it has finished, then fetch /jobs/<id>/result
+    """
+    params = dict(get_request_params())
+    metrics.OPERATIONS.inc(operation=metrics.operation_label(params.get("operation")))
+    try:
+        job = job_manager.submit(run_job, params)
+    except errors.JobQueueFullError:
+        metrics.ERRORS.inc(type="JobQueueFullError")
+        return {"error": ef.generate_job_queue_full_error()}, 429, {"Retry-After": "5"}
+    return job.status(), 202, {"Location": "/jobs/" + job.id}
+
+
+def find_job(job_id):
+    # Webhook refreshes run in their own pool, but are reported through the same routes as other jobs
+    return job_manager.get(job_id) or refresh_manager.get(job_id)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return {"error": ef.generate_job_not_found_error()}, 404
+    return job.status()
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Returns a finished job's result as /generate-data would have, or its error under "error". A job that has not
+    finished returns its status with a 409
+    """
+    job = find_job(job_id)
+    if job is None:
+        return {"error": ef.generate_job_not_found_error()}, 404
+    if job.state == jobs.SUCCEEDED:
+        return job.result
+    if job.state == jobs.FAILED:
+        return {"error": job.error}
+    if job.state == jobs.CANCELLED:
+        return {"error": ef.generate_job_cancelled_error()}
+    return job.status(), 409
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    Cancels a job. A queued job is cancelled straight away. A running job stops at its next check, which is made
+    between stages and between scenarios, so a single scenario being generated or updated is always finished first
+    """
+    job = job_manager.cancel(job_id) or refresh_manager.cancel(job_id)
+    if job is None:
+        return {"error": ef.generate_job_not_found_error()}, 404
+    return job.status()
+
+
+@app.route('/webhooks/page-updated', methods=['POST'])
+def page_updated():
+    """
+    Receives a Confluence page_updated webhook event and refreshes the page in the background: its scenarios are
+    fetched through the ScenarioGetter and the code for a "new" request is generated and stored, so the next "new"
+    request for the page version is served without fetching or generating anything. Returns the refresh job's status
+    with a 202, or a 429 once the refresh pool's queue is full. Refreshes have their own small pool, so a burst of
+    events cannot hold up user jobs. Events must be signed with the configured secret, and are refused with a 403
+    while no secret is configured
+    """
+    if not webhook_settings.get("secret"):
+        return {"error": ef.generate_webhook_disabled_error()}, 403
+    if not webhooks.verify_signature(webhook_settings.get("secret"), request.get_data(),
+                                     request.headers.get(webhooks.SIGNATURE_HEADER)):
+        return {"error": ef.generate_webhook_signature_error()}, 401
+    page = webhooks.parse_page_event(get_request_params())
+    if page is None:
+        return {"error": ef.generate_webhook_event_error()}, 400
+    metrics.WEBHOOK_EVENTS.inc()
+    try:
+        job = refresh_manager.submit(refresh_page, *page)
+    except errors.JobQueueFullError:
+        metrics.ERRORS.inc(type="JobQueueFullError")
+        return {"error": ef.generate_job_queue_full_error()}, 429, {"Retry-After": "5"}
+    return job.status(), 202, {"Location": "/jobs/" + job.id}
+
+
+def refresh_page(cancelled, space, page):
+    """
+    Fetches a page's scenarios and stores the code generated for them, unless it is already stored for the page's
+    current version. Runs as a background job for webhook events. See put_rendered for where the code is kept
+
+    Parameters:
+        cancelled (threading.Event): set when the job is cancelled
+        space (str): the key of a Confluence space
+        page (str): a Confluence page name
+
+    Returns:
+        dict: the page and its version, and whether code was generated for it
+    """
+    try:
+        with metrics.STAGE_SECONDS.time(stage="fetch"):
+            version, data = get_scenario_getter().get_versioned_requirements(space, page)
+    except HANDLED_ERRORS as e:
+        metrics.ERRORS.inc(type=type(e).__name__)
+        raise
+    if cancelled.is_set():
+        raise errors.JobCancelledError
+
+    generated = get_rendered(space, page, version) is None
+    if generated:
+        with metrics.STAGE_SECONDS.time(stage="pregenerate"):
+            put_rendered(space, page, version, cg.generate_new_scenarios(data))
+    return {"space": space, "page": page, "version": version, "scenarios": len(data), "generated": generated}
+
+
+def run_job(cancelled, params):
+    """
+    Runs a /generate-data request for a background job, stopping between stages, and between scenarios when
+    generating or updating a file, once the job is cancelled
+
+    Parameters:
+        cancelled (threading.Event): set when the job is cancelled
+        params (dict): the request's parameters
+
+    Returns:
+        str, or dict for an update with response=diff
+    """
+    try:
+        with metrics.STAGE_SECONDS.time(stage="fetch"):
+            version, data = get_scenario_getter().get_versioned_requirements(params.get("space"), params.get("page"))
+    except HANDLED_ERRORS as e:
+        metrics.ERRORS.inc(type=type(e).__name__)
+        raise
+    if cancelled.is_set():
+        raise errors.JobCancelledError
+
+    if params.get("operation") == "new":
+        rendered = get_rendered(params.get("space"), params.get("page"), version)
+        if rendered is not None:
+            return rendered
+        blocks = []
+        with metrics.STAGE_SECONDS.time(stage="generate"):
+            for block in cg.iter_new_scenarios(data):
+                if cancelled.is_set():
+                    raise errors.JobCancelledError
+                blocks.append(block)
+        return ''.join(blocks)
+    elif params.get("operation") == "update":
+        with metrics.STAGE_SECONDS.time(stage="update"):
+            if params.get("response") == "diff":
+                return cg.diff_existing_scenarios(data, params.get("file_text") or "", cancelled)
+            return cg.update_existing_scenarios(data, params.get("file_text") or "", cancelled)[0]
+    raise ValueError("Unknown operation: {}".format(params.get("operation")))
+
+
+def get_rendered(space, page, version):
+    """
+    Returns the code generated ahead of time for a page version, or None if there is none. It is looked for in this
+    process's cache, then in the ScenarioStore shared by every process
+
+    Returns:
+        str
+    """
+    key = (space, page, version)
+    rendered = rendered_cache.get(key)
+    if rendered is None:
+        rendered = get_scenario_getter().get_rendered(space, page, version)
+        if rendered is not None:
+            rendered_cache.put(key, rendered)
+    return rendered
+
+
+def put_rendered(space, page, version, code):
+    """
+    Keeps the code generated ahead of time for a page version in this process's cache and, when the store is
+    enabled, in the ScenarioStore, so that every worker process serves it
+    """
+    rendered_cache.put((space, page, version), code)
+    get_scenario_getter().put_rendered(space, page, version, code)
+
+
+@app.route('/generate-batch', methods=['POST'])
+def generate_batch():
+    """
+    Runs a list of jobs, each a JSON object with "space", "page", "operation" and, for updates, "file_text". Pages are
+    fetched in parallel and the code is generated in a pool of worker processes. Each job's result is returned under
+    "result", or its formatted error under "error", in the same order as the jobs. A job that fails, or is not a
+    valid job, has its error reported without affecting the others
+    """
+    jobs = get_request_params().get("jobs") or []
+    if not isinstance(jobs, list):
+        return {"error": ef.generate_batch_jobs_error()}, 400
+    valid = [isinstance(job, dict) and isinstance(job.get("space"), str) and isinstance(job.get("page"), str)
+             for job in jobs]
+
+    fetch_executor, generate_executor = get_batch_executors()
+    fetches = [fetch_executor.submit(get_scenario_getter().get_requirements, job["space"], job["page"])
+               if is_valid else None for job, is_valid in zip(jobs, valid)]
+
+    # Each job's code is generated as soon as its page has been fetched
+    generations = []
+    for job, fetch in zip(jobs, fetches):
+        if fetch is None:
+            generations.append(None)
+            continue
+        try:
+            data = fetch.result()
+            generations.append(generate_executor.submit(generate_code, job.get("operation"), data,
+                                                        job.get("file_text")))
+        except Exception as e:
+            generations.append(e)
+
+    results = []
+    for job, is_valid, generation in zip(jobs, valid, generations):
+        if not is_valid:
+            metrics.OPERATIONS.inc(operation="other")
+            results.append({"error": ef.generate_batch_jobs_error()})
+            continue
+        metrics.OPERATIONS.inc(operation=metrics.operation_label(job.get("operation")))
+        result = {"space": job["space"], "page": job["page"], "operation": job.get("operation")}
+        try:
+            if isinstance(generation, Exception):
+                raise generation
+            result["result"] = generation.result()
+        except HANDLED_ERRORS as e:
+            metrics.ERRORS.inc(type=type(e).__name__)
+            result["error"] = ef.generate_exception_error(e)
+        except BrokenProcessPool as e:
+            # A worker process died, which breaks the whole pool, so the next batch is given a new one
+            metrics.ERRORS.inc(type=type(e).__name__)
+            replace_generate_executor(generate_executor)
+            result["error"] = ef.generate_generic_error()
+        # Anything else, e.g. an unknown operation, fails only its own job
+        except Exception as e:
+            metrics.ERRORS.inc(type=type(e).__name__)
+            result["error"] = ef.generate_generic_error()
+        results.append(result)
+    return {"results": results}
+
+
+@app.after_request
+def compress_response(response):
+    return compressor.compress(request, response)
+
+
+def get_request_params():
+    """
+    Returns the parameters of a request: the JSON body of a POST, or the query string of a GET
+
+    Returns:
+        dict
+    """
+    if request.method == "POST":
+        return compression.read_json_body(request)
+    return request.args
+
+
+def generate_code(operation, scenarios, file_text=None):
+    """
+    Generates the code for an operation. Runs in the batch worker processes
+
+    Parameters:
+        operation (str): either "new" or "update"
+        scenarios (list): scenarios from ScenarioGetter.get_requirements
+        file_text (str): the existing file, for updates
+
+    Returns:
+        str
+    """
+    if operation == "new":
+        return Catch2CodeGenerator().generate_new_scenarios(scenarios)
+    elif operation == "update":
+        return Catch2CodeGenerator().update_existing_scenarios(scenarios, file_text or "")[0]
+    raise ValueError("Unknown operation: {}".format(operation))
+
+
+def get_batch_executors():
+    """
+    Returns the thread pool used to fetch pages for batches and the process pool used to generate their code,
+    creating them on first use
+
+    Returns:
+        tuple
+    """
+    global batch_executors
+    if batch_executors is None:
+        with batch_executors_lock:
+            if batch_executors is None:
+                batch_settings = load_config('Settings.yaml').get("batch", {})
+                batch_executors = (
+                    ThreadPoolExecutor(max_workers=batch_settings.get("fetch_workers", 8),
+                                       thread_name_prefix="batch-fetch"),
+                    create_generate_executor(batch_settings)
+                )
+    return batch_executors
+
+
+def create_generate_executor(batch_settings):
+    # Every server process has its own pool, so by default the cores are divided between the processes started by
+    # gunicorn.conf.py rather than each pool taking one process per core
+    generate_workers = batch_settings.get("generate_workers") or \
+        max(1, os.cpu_count() // int(os.environ.get("SERVER_WORKERS", 1)))
+    # Pool processes are started afresh rather than forked from this process and its threads
+    return ProcessPoolExecutor(max_workers=generate_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def replace_generate_executor(broken):
+    """
+    Replaces the batch process pool after one of its processes has died, unless another request already has
+    """
+    global batch_executors
+    with batch_executors_lock:
+        if batch_executors is not None and batch_executors[1] is broken:
+            batch_settings = load_config('Settings.yaml').get("batch", {})
+            batch_executors = (batch_executors[0], create_generate_executor(batch_settings))
+            broken.shutdown(wait=False)
+
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return get_scenario_getter().cache_stats()
+
+
+def create_app():
+    """
+    Creates the objects shared by the routes and returns the app. Each worker process of a WSGI server calls this
+    once. The ScenarioGetter, with its Confluence client, is created on the first request that needs it
+
+    Returns:
+        Flask
+    """
+    global cg, ef, profiler, compressor, job_manager, refresh_manager, rendered_cache, webhook_settings, metrics_store
+    settings = load_config('Settings.yaml')
+    cg = Catch2CodeGenerator()
+    ef = ErrorFormatter()
+    profiler = RequestProfiler(settings.get("profiling", {}))
+    compressor = compression.ResponseCompressor(settings.get("compression", {}))
+    app.config["MAX_CONTENT_LENGTH"] = compression.get_max_body_size(settings.get("compression", {}))
+    job_manager = jobs.JobManager(settings.get("jobs", {}), ef.generate_exception_error)
+    webhook_settings = settings.get("webhooks", {})
+    refresh_manager = jobs.JobManager(dict(settings.get("jobs", {}), workers=webhook_settings.get("workers", 1),
+                                           queue_depth=webhook_settings.get("queue_depth", 4)),
+                                      ef.generate_exception_error)
+    rendered_cache = ScenarioCache(webhook_settings.get("max_entries", 32), webhook_settings.get("ttl", 3600))
+    if settings.get("metrics", {}).get("directory"):
+        metrics_store = metrics.MetricsStore(settings["metrics"], collect_gauges)
+    return app
+
+
+def get_scenario_getter():
+    """
+    Returns the process's ScenarioGetter, creating it on first use
+
+    Returns:
+        ScenarioGetter
+    """
+    global sg
+    if sg is None:
+        with sg_lock:
+            if sg is None:
+                sg = ScenarioGetter()
+    return sg
+
+
+def load_config(file_name):
+    """
+    Loads a YAML file from the Config directory. When the SETTINGS_OVERRIDE environment variable names a YAML file,
+    relative to the Config directory, its settings are merged over those of Settings.yaml, so that a deployment can
+    change a few settings without copying the rest
+
+    Parameters:
+        file_name (str): the name of the file within the Config directory
+
+    Returns:
+        dict
+    """
+    config_directory = os.path.join(os.path.dirname(__file__), 'Config')
+    with open(os.path.join(config_directory, file_name), 'r') as config:
+        config_data = yaml.safe_load(config) or {}
+    if file_name == 'Settings.yaml' and os.environ.get("SETTINGS_OVERRIDE"):
+        with open(os.path.join(config_directory, os.environ["SETTINGS_OVERRIDE"]), 'r') as override:
+            config_data = merge_config(config_data, yaml.safe_load(override) or {})
+    return config_data
+
+
+def merge_config(config_data, override):
+    """
+    Returns config_data with the settings in override merged over it. Sections are merged setting by setting, and any
+    other value replaces the one it overrides
+
+    Parameters:
+        config_data (dict): the settings loaded from a file
+        override (dict): the settings to change
+
+    Returns:
+        dict
+    """
+    merged = dict(config_data)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
 class ScenarioGetter():
     def __init__(self):
         # Open config file to get Confluence credentials
-        config_path = os.path.join(os.path.dirname(__file__), 'Config/Credentials.yaml')
-        with open(config_path, 'r') as config:
-            config_data = yaml.safe_load(config)
-            self._confluence = Confluence(
-                url=config_data["url"],
-                username=config_data["username"],
-                password=config_data["password"]
-            )
+        config_data = load_config('Credentials.yaml')
+        settings = load_config('Settings.yaml')
+
+        # One pooled session is shared by every request and thread, so connections to Confluence are kept alive
+        confluence_settings = settings.get("confluence", {})
+        self._use_mock_data = confluence_settings.get("use_mock_data", True)
+        self._timeout = confluence_settings.get("timeout", 10)
+        self._session = self.create_session(confluence_settings)
+
+        # Pages of Requirements Yogi results are fetched concurrently, up to page_concurrency at a time
+        self._page_limit = confluence_settings.get("page_limit", 200)
+        self._page_executor = ThreadPoolExecutor(max_workers=confluence_settings.get("page_concurrency", 4),
+                                                 thread_name_prefix="requirements-page")
+        # atlassian is slow to import, so it is only imported once a ScenarioGetter is needed
+        from atlassian import Confluence
+        self._confluence = Confluence(
+            url=config_data["url"],
+            username=config_data["username"],
+            password=config_data["password"],
+            session=self._session,
+            timeout=self._timeout
+        )
+
+        # Parsed scenarios are cached per page version, so repeated requests for an unchanged page skip the fetch
+        cache_settings = settings.get("cache", {})
+        self._cache = ScenarioCache(cache_settings.get("max_entries", 128), cache_settings.get("ttl", 300))
+        self._in_flight = SingleFlight()
+
+        # Behind the cache, scenarios are kept on disk so they survive restarts and are shared by worker processes
+        self._store = create_scenario_store(settings.get("store", {}))
+
+    def create_session(self, confluence_settings):
+        """
+        Creates a session with a bounded connection pool that retries, with backoff, requests that fail with a
+        429 or 5xx status
+
+        Parameters:
+            confluence_settings (dict): the "confluence" section of Settings.yaml
+
+        Returns:
+            requests.Session
+        """
+        retry = Retry(
+            total=confluence_settings.get("retries", 3),
+            backoff_factor=confluence_settings.get("backoff_factor", 0.5),
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"])
+        )
+        pool_size = confluence_settings.get("pool_size", 10)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def check_page_exists(self, page, space):
         """
@@ -68,9 +787,12 @@ class ScenarioGetter():
             bool
         """
 
+        from atlassian.errors import ApiPermissionError
+
         try:
             # Check page exists in space in Confluence
-            page_found = self._confluence.page_exists(space, page)
+            with metrics.CONFLUENCE_REQUEST_SECONDS.time(call="page_exists"):
+                page_found = self._confluence.page_exists(space, page)
             return page_found
         # Exception can be caused by invalid credentials, for example
         except requests.HTTPError as e:
@@ -78,200 +800,268 @@ class ScenarioGetter():
                 raise errors.CredentialsError
             else:
                 raise errors.ConfluenceError
-        except atlassian.errors.ApiPermissionError:
+        # Connection failures, timeouts and exhausted retries
+        except requests.RequestException:
+            raise errors.ConfluenceError
+        except ApiPermissionError:
             raise errors.InvalidSpaceError
 
-    def parse_response_data(self, response):
+    def get_requirements_page(self, space, page_id, offset):
+        """
+        Takes a Confluence space key, page ID and result offset and returns one page of Requirements Yogi results
+        for the Confluence page. "results" holds the requirements and "count" the total number of requirements
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page_id (str): the ID of a Confluence page
+            offset (int): the index of the first requirement to return
+
+        Returns:
+            dict
+        """
+
+        # URL required for accessing requirements in the page
+        url = self._confluence.url + '/rest/reqs/1/requirement2/' + space
+        params = {
+            "spaceKey": space,
+            "q": "page = " + str(page_id),
+            "offset": offset,
+            "limit": self._page_limit
+        }
+
+        try:
+            with metrics.CONFLUENCE_REQUEST_SECONDS.time(call="requirements"):
+                response = self._session.get(url, params=params, headers={"Accept": "application/json"},
+                                             timeout=self._timeout)
+            if response.status_code == 401:
+                raise errors.CredentialsError
+            response.raise_for_status()
+            results_page = response.json()
+        except requests.RequestException:
+            raise errors.ConfluenceError
+        # A response that is not JSON, e.g. a single sign-on login page
+        except ValueError:
+            raise errors.ConfluenceError
+
+        return check_results_page(results_page)
+
+    def get_page_scenarios(self, space, page_id):
+        """
+        Takes a Confluence space key and page ID and returns the parsed scenarios of every requirement on the page.
+        Once the first page of results gives the total, the remaining pages are requested concurrently and each is
+        parsed as soon as it arrives
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page_id (str): the ID of a Confluence page
+
+        Returns:
+            list
+        """
+
+        first_page = self.get_requirements_page(space, page_id, 0)
+        parsed_pages = {0: self.parse_results_page(first_page["results"])}
+        offsets = get_remaining_offsets(first_page)
+
+        if offsets is not None:
+            futures = {self._page_executor.submit(self.get_requirements_page, space, page_id, offset): offset
+                       for offset in offsets}
+            try:
+                for future in as_completed(futures):
+                    parsed_pages[futures[future]] = self.parse_results_page(future.result()["results"])
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        else:
+            page_size = len(first_page["results"])
+            offset = get_next_offset(0, first_page["results"], page_size)
+            while offset is not None:
+                results = self.get_requirements_page(space, page_id, offset)["results"]
+                parsed_pages[offset] = self.parse_results_page(results)
+                offset = get_next_offset(offset, results, page_size)
+
+        return join_parsed_pages(parsed_pages)
+
+    def parse_results_page(self, results):
+        # If a scenario in the "Requirements" page on Confluence has BDD statements, then it should contain a
+        # "Scenario" data structure, otherwise parse_response_data raises ScenarioStatementsMissingError
+        with metrics.STAGE_SECONDS.time(stage="parse"):
+            return self.parse_response_data(results)
+
+    @staticmethod
+    def parse_response_data(response):
         scenarios = []
-        bdd_keywords_regex = "SCENARIO|GIVEN|WHEN|THEN|AND_GIVEN|AND_WHEN|AND_THEN"
 
         # Loop through every scenario on the page
         for sc in response:
             last_bdd_header = 0
-            scenario = {"id": sc["key"], "statements": []}
-            scenario_index = next(i for i, item in enumerate(sc["properties"]) if item["key"] == "Scenario")
+            statements = []
+            scenario_property = next((x for x in sc["properties"] if x["key"] == "Scenario"), None)
+            if scenario_property is None:
+                raise errors.ScenarioStatementsMissingError
 
             # Loop through all the BDD statements within the scenario
-            for j, curr_statement in enumerate(sc["properties"][scenario_index]["indexation"]["multivalues"]):
+            for curr_statement in scenario_property["indexation"]["multivalues"]:
 
                 # Skip if text is only whitespace or no text at all
-                if str.isspace(curr_statement) or not curr_statement:
+                if not curr_statement or curr_statement.isspace():
                     continue
 
                 curr_statement = curr_statement.replace("\"", "")
 
-                # Remove \xa0 (non-breaking space) character from string
-                curr_statement = normalize('NFKD', curr_statement)
+                # Remove \xa0 (non-breaking space) character from string. ASCII text is unchanged by normalisation
+                if not curr_statement.isascii():
+                    curr_statement = normalize('NFKD', curr_statement)
 
-                statement = {"bdd_type": "", "text": ""}
+                # Most statements are just KEYWORD(text), which the general rules below would parse the same way
+                simple_statement = SIMPLE_STATEMENT_PATTERN.match(curr_statement)
+                if simple_statement:
+                    last_bdd_header = len(statements)
+                    statements.append(Statement(BDD_TYPES[simple_statement.group(1)], simple_statement.group(2)))
+                    continue
 
-                bdd_header = re.search(bdd_keywords_regex, curr_statement)
+                bdd_header = BDD_KEYWORDS_PATTERN.search(curr_statement)
 
                 if bdd_header:
-                    statement["bdd_type"] = curr_statement[bdd_header.start():bdd_header.end()].title()
-                    last_bdd_header = j
+                    bdd_type = BDD_TYPES[bdd_header.group()]
+                    last_bdd_header = len(statements)
 
-                    match = re.search("\(.*?\)",curr_statement)
+                    match = STATEMENT_TEXT_PATTERN.search(curr_statement)
                     if match:
                         # There is an edge case where there is no closing bracket but regex still works due to brackets
                         # used within the statement text. In this case, just use the whole string
                         if curr_statement.count("(") != curr_statement.count(")"):
-                            statement["text"] = curr_statement[bdd_header.end() + 1:]
+                            text = curr_statement[bdd_header.end() + 1:]
                         else:
-                            statement["text"] = curr_statement[match.start()+1:match.end()-1]
+                            text = curr_statement[match.start()+1:match.end()-1]
                     else:
-                        statement["text"] = curr_statement[bdd_header.end()+1:]
-                    scenario["statements"].append(statement)
+                        text = curr_statement[bdd_header.end()+1:]
+                    statements.append(Statement(bdd_type, text))
                 else:
-                    scenario["statements"][last_bdd_header]["text"] += " \\ \n" + curr_statement
-            scenarios.append(scenario)
+                    statement = statements[last_bdd_header]
+                    statements[last_bdd_header] = Statement(statement.bdd_type, statement.text + " \\ \n" + curr_statement)
+            scenarios.append(Scenario(sc["key"], tuple(statements)))
         return scenarios
 
-    def get_requirements(self, space, page):
+    def get_page(self, space, page):
         """
-        Takes a Confluence space key and page name and, if found, returns a list of all BDD scenarios
-        stored on the page
+        Takes a Confluence space key and page name and returns the page's ID and current version number. One lookup
+        gives both, and shows whether the page exists
 
         Parameters:
             space (str): the key of a Confluence space
             page (str): a Confluence page name
 
         Returns:
-            list
+            tuple: (page ID, version)
         """
 
-        if os.environ.get("HTTP_PROXY") or os.environ.get("HTTPS_PROXY"):
-            raise errors.ProxyEnvError
-        try:
-            # page_found = self.check_page_exists(page, space)
-            page_found = True
-            if not page_found:
-                raise errors.PageNotFoundError
-        except errors.CredentialsError:
-            raise
-        except errors.ConfluenceError:
-            raise
-        except errors.InvalidSpaceError:
-            raise
+        if self._use_mock_data:
+            return get_mock_page()
+
+        from atlassian.errors import ApiPermissionError
 
         try:
-            # page_id = self._confluence.get_page_id(space, page)
-            pass
+            with metrics.CONFLUENCE_REQUEST_SECONDS.time(call="page"):
+                page_data = self._confluence.get_page_by_title(space, page, expand="version")
         except requests.HTTPError as e:
             if e.response.status_code == 401:
                 raise errors.CredentialsError
             else:
                 raise errors.ConfluenceError
+        except requests.RequestException:
+            raise errors.ConfluenceError
+        except ApiPermissionError:
+            raise errors.InvalidSpaceError
+        except ValueError:
+            raise errors.ConfluenceError
 
-        # URL required for accessing requirements in the page
-        # Not used for uni project as mock data is used
-        # url = self._confluence.url + '/rest/reqs/1/requirement2/' + space
-
-        # params = {
-        #     "Accept": 'application/json',
-        #     "spaceKey": space,
-        #     "q": "page = " + page_id
-        # }
-
-        # response = requests.get(url,
-        #                         params,
-        #                         auth=requests.auth.HTTPBasicAuth(self._confluence.username, self._confluence.password))
-
-        # if response.status_code == 401:
-        #     raise errors.CredentialsError
-
-        # response_data = response.json()['results']
-        
-        mock_data = [
-            {
-                'key': 'SCEN-1',
-                'properties': [
-                    {
-                        'key': 'Scenario',
-                        'indexation':
-                            {
-                                'multivalues': 
-                                [
-                                    'SCENARIO("Mock scenario 1")',
-                                    'GIVEN("Mock GIVEN statement for scenario 1")',
-                                    'WHEN("Mock WHEN statement for scenario 1")',
-                                    'THEN("Mock THEN statement for scenario 1")'
-                                ]
-                            }
-                    }
-                ]
-            },
-            {
-                'key': 'SCEN-2',
-                'properties': [
-                    {
-                        'key': 'Scenario',
-                        'indexation': 
-                            {
-                                'multivalues': [
-                                    'SCENARIO("Mock scenario 2")',
-                                    'GIVEN("Mock GIVEN statement for scenario 2")',
-                                    'WHEN("Mock WHEN statement for scenario 2")',
-                                    'THEN("Mock THEN statement for scenario 2")'
-                                ]
-                            }
-                    }
-                ]
-            },
-            {
-                'key': 'SCEN-3',
-                'properties': [
-                    {
-                        'key': 'Scenario',
-                        'indexation': 
-                        {
-                            'multivalues': [
-                                'SCENARIO("Mock scenario 3")',
-                                'GIVEN("Mock GIVEN statement for scenario 3")',
-                                'WHEN(Mock WHEN statement for scenario 3")',
-                                'THEN("Mock THEN statement for scenario 3")'
-                            ]
-                        }
-                    }
-                ]
-            },
-            {
-                'key': 'SCEN-4',
-                'properties': [
-                        {
-                            'key': 'Scenario',
-                            'indexation': 
-                            {
-                                'multivalues': [
-                                    'SCENARIO("Mock scenario 4")',
-                                    'GIVEN("Mock GIVEN statement for scenario 4")',
-                                    'WHEN("Mock WHEN statement for scenario 4")',
-                                    'THEN("Mock THEN statement for scenario 4")'
-                                ]
-                            }
-                    }
-                ]
-            }
-        ]
-
-        response_data = mock_data
-
-        if len(response_data) == 0:
-            raise errors.ScenariosNotFoundError
-
-        # If a scenario in the "Requirements" page on Confluence has BDD statements, then scenario_data should contain
-        # "Scenario" data structure for each scenario
-        for scenario in response_data:
-            if next((x for x in scenario['properties'] if x['key'] == 'Scenario'), None) is None:
-                raise errors.ScenarioStatementsMissingError
+        if page_data is None:
+            raise errors.PageNotFoundError
+        try:
+            return page_data["id"], page_data["version"]["number"]
+        except (KeyError, TypeError):
+            raise errors.ConfluenceError
+
+    def get_requirements(self, space, page):
+        """
+        Takes a Confluence space key and page name and, if found, returns a list of all BDD scenarios
+        stored on the page. Scenarios are served from the cache while the page version is unchanged
 
-        scenario_data = self.parse_response_data(response_data)
-        return scenario_data
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+
+        Returns:
+            list
+        """
+
+        return self.get_versioned_requirements(space, page)[1]
+
+    def get_versioned_requirements(self, space, page):
+        """
+        Takes a Confluence space key and page name and, if found, returns the page's current version number and a
+        list of all BDD scenarios stored on the page
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+
+        Returns:
+            tuple: (version, scenarios)
+        """
+
+        check_proxy_env()
+
+        # Concurrent requests for the same page share one version check, fetch and parse
+        return self._in_flight.do((space, page), lambda: self.load_requirements(space, page))
+
+    def load_requirements(self, space, page):
+        page_id, version = self.get_page(space, page)
+        cache_key = (space, page, version)
+        scenario_data = self._cache.get(cache_key)
+        if scenario_data is None:
+            scenario_data = read_stored_scenarios(self._cache, self._store, cache_key)
+        if scenario_data is None:
+            scenario_data = self.fetch_requirements(space, page_id)
+            keep_scenarios(self._cache, self._store, cache_key, scenario_data)
+        return version, scenario_data
+
+    def get_rendered(self, space, page, version):
+        """
+        Returns the code stored for a page version, or None if there is none or the store is not enabled
+
+        Returns:
+            str
+        """
+        if self._store is None:
+            return None
+        return self._store.get_rendered(space, page, version)
+
+    def put_rendered(self, space, page, version, code):
+        if self._store is not None:
+            self._store.put_rendered(space, page, version, code)
+
+    def cache_stats(self):
+        return get_cache_stats(self._cache, self._store, self._in_flight.shared)
+
+    def fetch_requirements(self, space, page_id):
+        """
+        Takes a Confluence space key and page ID, from get_page, and fetches and parses all BDD scenarios stored on
+        the page
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page_id (str): the ID of a Confluence page
+
+        Returns:
+            list
+        """
 
-class ScenarioStatus(Enum):
-    MISSING = 1
-    UPDATED = 2
-    UNCHANGED = 3
+        if self._use_mock_data:
+            return check_scenarios_found(self.parse_results_page(MOCK_REQUIREMENTS))
+        return check_scenarios_found(self.get_page_scenarios(space, page_id))
 
 class CodeGenerator(abc.ABC):
 
@@ -286,6 +1076,9 @@ class CodeGenerator(abc.ABC):
     def update_existing_scenarios(self, scenarios, existing):
         pass
 
+    def iter_new_scenarios(self, scenarios):
+        yield self.generate_new_scenarios(scenarios)
+
 
 class Catch2CodeGenerator(CodeGenerator):
     def __init__(self):
@@ -302,30 +1095,48 @@ class Catch2CodeGenerator(CodeGenerator):
         }
         self.tab = "    "
 
+        self._parser = Catch2Parser([x["header"] for x in self.bdd_info.values()])
+
+        # Each template is compiled once into a format function, e.g. 'GIVEN("{text}")'.format, keyed by both the
+        # bdd_info key and the bdd_type the parser gives it ("and_given" and "And_Given")
+        self._renderers = {}
+        for key, info in self.bdd_info.items():
+            template = (info["header"] + info["text"]).replace("{", "{{").replace("}", "}}")
+            render = template.replace("%text%", "{text}").replace("%id%", "{id}").format
+            self._renderers[key] = render
+            self._renderers[key.title()] = render
+
     def write_scenarios_to_file(self, scenarios, path):
         if os.path.isfile(path):
             raise FileExistsError
-        file_text = self.generate_new_scenarios(scenarios)
         with open(path, 'w') as f:
-            f.write(file_text)
+            for block in self.iter_new_scenarios(scenarios):
+                f.write(block)
 
     def generate_new_scenarios(self, scenarios):
-        file_text = ""
+        return ''.join(self.iter_new_scenarios(scenarios))
+
+    def iter_new_scenarios(self, scenarios):
+        """
+        Generates the code for each scenario in turn, yielding each block as soon as it is produced. Joined together,
+        the blocks are identical to the output of generate_new_scenarios
+
+        Parameters:
+            scenarios (list): scenarios from ScenarioGetter.parse_response_data
+
+        Returns:
+            generator
+        """
+        # Whitespace at the end of a block is held back until more code follows it, as the end of the file is stripped
+        pending_whitespace = ""
         for scenario in scenarios:
-            file_text += self.construct_nested_statements(self.get_scenario_code(scenario["statements"], scenario["id"]), 0)
-        return file_text.rstrip()
-
-    def write_scenario(self, scenario, tab_level):
-        text = ""
-        scenario_code = self.get_scenario_code(scenario["statements"], scenario["id"])
-        for statement in scenario_code:
-            text += self.tab * tab_level + statement
-            text += "\n" + self.tab * tab_level + "{\n"
-            tab_level += 1
-        for _ in scenario_code:
-            text += self.tab * (tab_level - 1) + "}\n"
-            tab_level -= 1
-        return text
+            block = self.construct_nested_statements(self.get_scenario_code(scenario.statements, scenario.id), 0)
+            code = block.rstrip()
+            if code:
+                yield pending_whitespace + code
+                pending_whitespace = block[len(code):]
+            else:
+                pending_whitespace += block
 
     def update_existing_file(self, scenarios, path):
         try:
@@ -343,7 +1154,59 @@ class Catch2CodeGenerator(CodeGenerator):
 
         return updated_scenarios, missing_scenarios, unchanged_scenarios
 
-    def update_existing_scenarios(self, scenarios, existing):
+    def update_existing_scenarios(self, scenarios, existing, cancelled=None):
+        lines_string, edits, updates_scenarios, missing_scenarios, unchanged_scenarios = self.get_update_edits(
+            scenarios, existing, cancelled)
+        if edits:
+            lines_string = self.apply_edits(lines_string, edits).rstrip()
+        return lines_string, updates_scenarios, missing_scenarios, unchanged_scenarios
+
+    def diff_existing_scenarios(self, scenarios, existing, cancelled=None):
+        """
+        Updates existing code and returns the changes made to it rather than the updated code. "edits" lists each
+        changed range of lines as [start, end, lines], where lines[start:end] of the existing code, split with
+        str.splitlines(keepends=True), are replaced by the given lines. Applied from last to first, the edits give the
+        output of update_existing_scenarios. "diff" is the same change as a unified diff
+
+        Parameters:
+            scenarios (list): scenarios from ScenarioGetter.parse_response_data
+            existing (str): the existing code
+            cancelled (jobs.CancelFlag): see get_update_edits
+
+        Returns:
+            dict
+        """
+        lines_string, edits, updates_scenarios, missing_scenarios, unchanged_scenarios = self.get_update_edits(
+            scenarios, existing, cancelled)
+        strip_edit = self.get_strip_edit(lines_string, edits) if edits else None
+        if strip_edit:
+            edits.append(strip_edit)
+
+        existing_lines = existing.splitlines(keepends=True)
+        normalised_lines = [x.replace("\t", "    ") for x in existing_lines]
+        line_edits = patches.line_edits(existing_lines, normalised_lines, edits)
+
+        return {
+            "edits": line_edits,
+            "diff": patches.unified_diff(existing_lines, line_edits),
+            "updated": [x.id for x in updates_scenarios],
+            "missing": [x.id for x in missing_scenarios],
+            "unchanged": [x.id for x in unchanged_scenarios]
+        }
+
+    def get_update_edits(self, scenarios, existing, cancelled=None):
+        """
+        Works out the edits needed to update existing code without applying them. The edits are made against the code
+        with its tabs replaced, which is returned with them
+
+        Parameters:
+            scenarios (list): scenarios from ScenarioGetter.parse_response_data
+            existing (str): the existing code
+            cancelled (jobs.CancelFlag): when given, checked between scenarios, raising JobCancelledError once set
+
+        Returns:
+            tuple
+        """
         lines_string = existing
 
         # First, auto replace any \t tabs with four spaces
@@ -353,139 +1216,196 @@ class Catch2CodeGenerator(CodeGenerator):
         missing_scenarios = []
         unchanged_scenarios = []
 
+        # Index every scenario block in one pass, so each scenario is a dictionary lookup rather than a scan of the
+        # whole file. Edits are made against the original string and applied together at the end
+        scenario_sections = self.find_scenarios(self._parser.parse(lines_string))
+        scenario_index = {tag: x for x in scenario_sections for tag in x.tags}
+        scenario_edits = {}
+
         for scenario in scenarios:
-            status, updated_file_string = self.update_scenario_code(scenario, lines_string)
-            if status == ScenarioStatus.UPDATED:
-                lines_string = updated_file_string
-                updates_scenarios.append(scenario)
-            elif status == ScenarioStatus.MISSING:
+            if cancelled is not None and cancelled.is_set():
+                raise errors.JobCancelledError
+            block = scenario_index.get(scenario.id)
+            if block is None:
                 missing_scenarios.append(scenario)
+                continue
+            edits = self.get_scenario_edits(scenario, block, lines_string)
+            if edits:
+                scenario_edits[scenario.id] = edits
+                updates_scenarios.append(scenario)
             else:
                 unchanged_scenarios.append(scenario)
 
-        for scenario in missing_scenarios:
-            missing_text = self.construct_nested_statements(self.get_scenario_code(scenario["statements"], scenario["id"]))
-            lines_string = self.insert_after_last_scenario(lines_string, missing_text).rstrip()
-        return lines_string, updates_scenarios, missing_scenarios, unchanged_scenarios
+        edits = [edit for edits in scenario_edits.values() for edit in edits]
 
-    def get_scenario_code(self, scenario, id):
-        code = []
-        for statement in scenario:
-            code.append(self.bdd_info[str(statement["bdd_type"]).lower()]["header"] + self.bdd_info[str(statement["bdd_type"]).lower()]["text"].replace("%text%", statement["text"]).replace("%id%", id))
-        return code
+        # Render all missing scenarios together and insert them after the last scenario as a single edit
+        if missing_scenarios:
+            missing_text = ''.join(self.construct_nested_statements(self.get_scenario_code(x.statements, x.id))
+                                   for x in missing_scenarios)
+            closed_scenarios = [x for x in scenario_sections if x.end is not None]
+            if closed_scenarios:
+                edits.append((closed_scenarios[-1].end, closed_scenarios[-1].end, "\n" + missing_text))
+            # If no other scenarios are in file, just add all scenarios to end
+            else:
+                edits.append((len(lines_string), len(lines_string), missing_text))
 
-    def update_scenario_code(self, scenario, file_string):
-        # Get code equivalents of updated scenario statements
-        updated_scenario_code = self.get_scenario_code(scenario["statements"], scenario["id"])
+        return lines_string, edits, updates_scenarios, missing_scenarios, unchanged_scenarios
 
-        # Generate regex pattern of BDD headers
-        bdd_headers_regex = '|'.join([x["header"] for x in self.bdd_info.values()])
+    def get_strip_edit(self, file_string, edits):
+        """
+        Returns the edit that, applied with the given edits, strips the whitespace from the end of the file. Edits
+        left with nothing but whitespace after them are removed from the list and covered by the returned edit
 
-        # Regex searches for the Scenario header, then some text, then the scenario ID, then some text, then either
-        # the next Scenario keyword or the end of the string. Note that for the 'some text' the regex pattern ensures
-        # that the Scenario header is not between the first occurence of scenario and the ID
-        pattern_string = self.bdd_info["scenario"]["header"]+'(?!.*'+self.bdd_info["scenario"]["header"]+'.*'+scenario["id"]+').*?'+scenario["id"]+'.*?(?='+self.bdd_info["scenario"]["header"]+'|\Z)'
-        pattern = re.compile(pattern_string, re.MULTILINE | re.DOTALL)
-        scenario_match = pattern.search(file_string)
+        Parameters:
+            file_string (str): the string the edits were made against
+            edits (list): (start, end, text) tuples with offsets into file_string
 
-        # Scenario not in file, therefore can't update
-        if not scenario_match:
-            return ScenarioStatus.MISSING, ""
+        Returns:
+            tuple, or None if there is no whitespace to strip
+        """
+        edits.sort(key=lambda edit: (edit[0], edit[1]))
+
+        # The code from tail_start to the end of the file is replaced by tail_text, which is all whitespace
+        tail_start = len(file_string)
+        tail_text = ""
+        while True:
+            previous_end = edits[-1][1] if edits else 0
+            kept = (file_string[previous_end:tail_start] + tail_text).rstrip()
+            if kept or not edits:
+                break
+            start, end, text = edits.pop()
+            tail_text = text + file_string[end:tail_start] + tail_text
+            tail_start = start
+
+        # Cut in the unedited code before the tail, or within the text of the removed edits
+        if len(kept) <= tail_start - previous_end:
+            if previous_end + len(kept) == len(file_string):
+                return None
+            return previous_end + len(kept), len(file_string), ""
+        return tail_start, len(file_string), kept[tail_start - previous_end:]
 
-        # Create substring of file
-        scenario_substring = file_string[scenario_match.start():scenario_match.end()]
-        original = scenario_substring
+    def get_scenario_code(self, scenario, id):
+        code = []
+        for statement in scenario:
+            render = self._renderers.get(statement.bdd_type)
+            if render is None:
+                render = self._renderers[str(statement.bdd_type).lower()]
+            code.append(render(text=statement.text, id=id))
+        return code
 
-        # Find all current BDD statements within scenario
-        matches = re.finditer('('+bdd_headers_regex+')\(.*?\)', scenario_substring, re.MULTILINE|re.DOTALL)
+    def index_scenarios(self, file_string):
+        """
+        Parses a Catch2 file and returns a dictionary mapping each scenario ID (taken from the scenario's tags) to
+        its section. Where an ID appears more than once, the last scenario with it is used
 
-        match_list = []
-        for match in matches:
-            match_list.append(scenario_substring[match.start():match.end()])
+        Parameters:
+            file_string (str): the contents of a Catch2 test file
 
-        # Replace each existing statement with new statement
-        if len(updated_scenario_code) == len(match_list):
-            for i in range(len(updated_scenario_code)):
-                scenario_substring = scenario_substring.replace(match_list[i], updated_scenario_code[i])
+        Returns:
+            dict
+        """
+        index = {}
+        for scenario in self.find_scenarios(self._parser.parse(file_string)):
+            for tag in scenario.tags:
+                index[tag] = scenario
+        return index
 
-        # Replace each existing statement with new statement, then add in additional statements
-        elif len(updated_scenario_code) > len(match_list):
-            for i in range(len(match_list)):
-                scenario_substring = scenario_substring.replace(match_list[i], updated_scenario_code[i])
+    def find_scenarios(self, sections):
+        """
+        Takes the sections returned by Catch2Parser.parse and returns every scenario among them, in file order
 
-            # Find location of last statement in updated string
-            last_statement = scenario_substring.find(updated_scenario_code[len(match_list)-1])
+        Parameters:
+            sections (list): parsed Catch2 sections
 
-            # Get number of '{' within last BDD statement
-            num_of_openings = scenario_substring[last_statement:].count('{')
-            statement_start = self.find_nth_occurrence(scenario_substring[last_statement:], '{', 1)
-            statement_end = self.find_nth_occurrence(scenario_substring[last_statement:], '}', num_of_openings)+1
+        Returns:
+            list
+        """
+        scenario_header = self.bdd_info["scenario"]["header"]
+        return [x for root in sections for x in root.walk() if x.keyword.startswith(scenario_header)]
 
-            # Separate the last statement code block lines in a list
-            statement_as_list = scenario_substring[last_statement+statement_start:last_statement+statement_end].split('\n')
+    def get_scenario_edits(self, scenario, block, file_string):
+        """
+        Takes a scenario and its block from index_scenarios and returns the list of (start, end, text) edits needed
+        to bring the block in line with the scenario. An empty list means the scenario is unchanged
 
-            # Create the code for the new statements and insert it into the current last
-            tab_level = int((len(scenario_substring[:last_statement])-len(scenario_substring[:last_statement].rstrip(" "))) / 4) + 1
-            new_statements = self.construct_nested_statements(updated_scenario_code[len(match_list):], tab_level)
-            statement_as_list.insert(-1, new_statements.rstrip())
+        Parameters:
+            scenario (Scenario): a scenario from ScenarioGetter.parse_response_data
+            block (Section): the scenario's section from index_scenarios
+            file_string (str): the string the block was indexed from
 
-            # Replace the existing last statement code with code that includes the new statements within
-            new_statements = '\n'.join(statement_as_list)
-            scenario_substring = scenario_substring.replace(scenario_substring[last_statement+statement_start:last_statement+statement_end], new_statements)
+        Returns:
+            list
+        """
+        # Get code equivalents of updated scenario statements
+        updated_scenario_code = self.get_scenario_code(scenario.statements, scenario.id)
 
-        # Replace some existing statements with the new ones, then remove any statements that are no longer needed
-        else:
-            for i in range(len(updated_scenario_code)):
-                scenario_substring = scenario_substring.replace(match_list[i], updated_scenario_code[i])
+        # Sections left unclosed at the end of the file cannot be safely rewritten
+        statements = [x for x in block.walk() if x.end is not None]
+        if not updated_scenario_code or block.end is None:
+            return []
 
-            # Find the start '{' and close '}' of the last updated scenario
-            last_statement = scenario_substring.find(updated_scenario_code[len(updated_scenario_code)-1])
-            num_of_openings = scenario_substring[last_statement:].count('{')
-            pattern = '\{.*?'*num_of_openings + '.*?\}'*num_of_openings
-            statement_start_and_close = re.search(pattern, scenario_substring[last_statement:], re.MULTILINE | re.DOTALL)
+        # Replace each existing statement with new statement
+        edits = []
+        for statement, code in zip(statements, updated_scenario_code):
+            if file_string[statement.start:statement.header_end] != code:
+                edits.append((statement.start, statement.header_end, code))
+
+        # Add in additional statements inside the current last statement
+        if len(updated_scenario_code) > len(statements):
+            last_statement = statements[-1]
+            line_start = file_string.rfind("\n", 0, last_statement.start) + 1
+            indent = file_string[line_start:last_statement.start]
+            tab_level = int((len(indent) - len(indent.rstrip(" "))) / 4) + 1
+            new_statements = self.construct_nested_statements(updated_scenario_code[len(statements):], tab_level).rstrip()
+
+            # Insert at the start of the line holding the closing brace, or before the brace if the body is one line
+            close = last_statement.end - 1
+            close_line_start = file_string.rfind("\n", last_statement.body_start, close) + 1
+            if close_line_start:
+                edits.append((close_line_start, close_line_start, new_statements + "\n"))
+            else:
+                code_end = close
+                while file_string[code_end - 1] == " ":
+                    code_end -= 1
+                edits.append((code_end, close, "\n" + new_statements + "\n" + self.tab * (tab_level - 1)))
+
+        # Remove any statements that are no longer needed from within the new last statement
+        elif len(updated_scenario_code) < len(statements):
+            last_statement = statements[len(updated_scenario_code) - 1]
+            if last_statement.end - last_statement.body_start > 2:
+                edits.append((last_statement.body_start + 1, last_statement.end - 1, ""))
+        return edits
+
+    def apply_edits(self, file_string, edits):
+        """
+        Applies a list of non-overlapping (start, end, text) edits to a string in a single splice
 
-            # Remove any text between the start and close of the statement
-            scenario_substring = scenario_substring.replace(scenario_substring[last_statement+statement_start_and_close.start()+1:last_statement+statement_start_and_close.end()-1], "")
+        Parameters:
+            file_string (str): the string to edit
+            edits (list): (start, end, text) tuples with offsets into file_string
 
-        if original != scenario_substring:
-            file_string = file_string.replace(original, scenario_substring).rstrip()
-        else:
-            return ScenarioStatus.UNCHANGED, ""
-        return ScenarioStatus.UPDATED, file_string
+        Returns:
+            str
+        """
+        pieces = []
+        position = 0
+        for start, end, text in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+            pieces.append(file_string[position:start])
+            pieces.append(text)
+            position = end
+        pieces.append(file_string[position:])
+        return ''.join(pieces)
 
     def construct_nested_statements(self, statements, tab_level=0):
-        text = ""
+        text = []
         for statement in statements:
-            text += self.tab * tab_level + statement
-            text += "\n" + self.tab * tab_level + "{\n"
+            indent = self.tab * tab_level
+            text.append(indent + statement + "\n" + indent + "{\n")
             tab_level += 1
         for _ in statements:
-            text += self.tab * (tab_level - 1) + "}\n"
+            text.append(self.tab * (tab_level - 1) + "}\n")
             tab_level -= 1
-        return text
-
-    def find_nth_occurrence(self, string, substring, occurrence):
-        occurrences = (i for i, l in enumerate(string) if l == substring)
-        for _ in range(occurrence - 1):
-            next(occurrences)
-        return next(occurrences)
-
-    def insert_after_last_scenario(self, file_string, new_string):
-        # Find all current BDD statements within scenario
-        matches = re.finditer('(' + self.bdd_info["scenario"]["header"] + ')\(.*?\)', file_string)
-        match_list = []
-        for match in matches:
-            match_list.append(match.start())
-        try:
-            last_scenario_index = match_list[-1]
-            # Get number of '{' within last BDD statement
-            num_of_openings = file_string[last_scenario_index:].count('{')
-            scenario_end = self.find_nth_occurrence(file_string[last_scenario_index:], '}', num_of_openings) + 1
-            file_string = file_string[:last_scenario_index + scenario_end] + "\n" + new_string + file_string[last_scenario_index + scenario_end:]
-        # If no other scenarios are in file, just add all scenarios to end
-        except IndexError:
-            file_string = file_string + new_string
-        return file_string
+        return ''.join(text)
 
 class ErrorFormatter():
     def generate_error_string(self, text):
@@ -528,12 +1448,72 @@ class ErrorFormatter():
         text = "Found HTTP_PROXY or HTTPS_PROXY environment variables. Either rename or delete them before using the application"
         return self.generate_error_string(text)
 
+    def generate_job_queue_full_error(self):
+        text = "Too many jobs are waiting to run. Try again shortly."
+        return self.generate_error_string(text)
+
+    def generate_job_not_found_error(self):
+        text = "Job not found. It may have expired or been cancelled."
+        return self.generate_error_string(text)
+
+    def generate_job_cancelled_error(self):
+        text = "Job was cancelled."
+        return self.generate_error_string(text)
+
+    def generate_job_worker_lost_error(self):
+        text = "Job did not finish because the server process running it stopped. Submit it again."
+        return self.generate_error_string(text)
+
+    def generate_batch_jobs_error(self):
+        text = "Batch jobs must be a list of objects, each with a space and page."
+        return self.generate_error_string(text)
+
+    def generate_webhook_signature_error(self):
+        text = "Webhook event signature is missing or incorrect."
+        return self.generate_error_string(text)
+
+    def generate_webhook_disabled_error(self):
+        text = "Webhook events are disabled because no webhook secret is configured."
+        return self.generate_error_string(text)
+
+    def generate_webhook_event_error(self):
+        text = "Webhook event does not name a page. Expected a page with a spaceKey and title."
+        return self.generate_error_string(text)
+
     def generate_generic_error(self):
         text = "Could not complete operation."
         return self.generate_error_string(text)
 
+    def generate_exception_error(self, exception):
+        """
+        Takes one of the exceptions in HANDLED_ERRORS and returns its error message
+
+        Parameters:
+            exception (Exception): the exception raised
+
+        Returns:
+            str
+        """
+        if isinstance(exception, errors.PageNotFoundError):
+            return self.generate_page_not_found_error()
+        elif isinstance(exception, errors.CredentialsError):
+            return self.generate_credentials_error()
+        elif isinstance(exception, errors.ConfluenceError):
+            return self.generate_confluence_error()
+        elif isinstance(exception, errors.InvalidSpaceError):
+            return self.generate_invalid_space_error()
+        elif isinstance(exception, errors.ScenariosNotFoundError):
+            return self.generate_no_scenarios_error()
+        elif isinstance(exception, errors.ScenarioStatementsMissingError):
+            return self.generate_missing_statement_error()
+        elif isinstance(exception, errors.ProxyEnvError):
+            return self.generate_proxy_env_error()
+        elif isinstance(exception, errors.JobWorkerLostError):
+            return self.generate_job_worker_lost_error()
+        elif isinstance(exception, FileExistsError):
+            return self.generate_error_string("File already exists")
+        return self.generate_generic_error()
+
 if __name__ == "__main__":
-    sg = ScenarioGetter()
-    cg = Catch2CodeGenerator()
-    ef = ErrorFormatter()
-    app.run(host="0.0.0.0", port=8002)
\ No newline at end of file
+    # Flask's development server. In production the app is served by gunicorn through wsgi.py
+    create_app().run(host="0.0.0.0", port=8002)
\ No newline at end of file
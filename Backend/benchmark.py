@@ -0,0 +1,256 @@
+"""
+Benchmarks for parsing Requirements Yogi results, generating new Catch2 files and updating existing ones, run against
+synthetic data of configurable size. Results are written as JSON so runs from different commits can be compared:
+
+    python benchmark.py --scenarios 100,1000,10000 --output before.json
+    python benchmark.py --scenarios 100,1000,10000 --output after.json --compare before.json
+"""
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from unicodedata import normalize
+
+from bdd_generator import Catch2CodeGenerator, ScenarioGetter
+from mock_data import generate_requirements
+from scenario_model import Scenario, Statement
+
+# Statements that take the general path through parse_response_data rather than the KEYWORD(text) fast path
+EDGE_CASE_STATEMENTS = [
+    'GIVEN("A statement (with brackets) in its text")',
+    'WHEN("A statement with no closing bracket"',
+    'THEN("A statement with a non\xa0breaking\xa0space")',
+    '  AND_THEN("A statement with leading whitespace")',
+    'AND_GIVEN("A statement") followed by (bracketed) text',
+    'a continuation line (with brackets',
+    'Prefix text before GIVEN("a keyword")',
+    'AND_WHEN a statement with no brackets at all',
+    '   ',
+    '',
+    'SCENARIO_METHOD("A scenario method")',
+    'THEN("An unterminated (bracket")'
+]
+
+
+def legacy_parse_response_data(response):
+    """
+    parse_response_data as it was before statement parsing was precompiled: the baseline parser, with continuation
+    lines appended to the last statement parsed rather than to a multivalues index. Kept to check that the current
+    parser gives identical output
+    """
+    scenarios = []
+    bdd_keywords_regex = "SCENARIO|GIVEN|WHEN|THEN|AND_GIVEN|AND_WHEN|AND_THEN"
+
+    for sc in response:
+        last_bdd_header = 0
+        scenario = {"id": sc["key"], "statements": []}
+        scenario_index = next(i for i, item in enumerate(sc["properties"]) if item["key"] == "Scenario")
+
+        for curr_statement in sc["properties"][scenario_index]["indexation"]["multivalues"]:
+            if str.isspace(curr_statement) or not curr_statement:
+                continue
+
+            curr_statement = curr_statement.replace("\"", "")
+            curr_statement = normalize('NFKD', curr_statement)
+
+            statement = {"bdd_type": "", "text": ""}
+            bdd_header = re.search(bdd_keywords_regex, curr_statement)
+
+            if bdd_header:
+                statement["bdd_type"] = curr_statement[bdd_header.start():bdd_header.end()].title()
+                last_bdd_header = len(scenario["statements"])
+
+                match = re.search(r"\(.*?\)", curr_statement)
+                if match:
+                    if curr_statement.count("(") != curr_statement.count(")"):
+                        statement["text"] = curr_statement[bdd_header.end() + 1:]
+                    else:
+                        statement["text"] = curr_statement[match.start()+1:match.end()-1]
+                else:
+                    statement["text"] = curr_statement[bdd_header.end()+1:]
+                scenario["statements"].append(statement)
+            else:
+                scenario["statements"][last_bdd_header]["text"] += " \\ \n" + curr_statement
+        scenarios.append(scenario)
+    return scenarios
+
+
+def generate_edge_case_requirements():
+    requirements = generate_requirements(len(EDGE_CASE_STATEMENTS))
+    for requirement, statement in zip(requirements, EDGE_CASE_STATEMENTS):
+        requirement["properties"][0]["indexation"]["multivalues"].insert(2, statement)
+    return requirements
+
+
+def verify_parser(requirements):
+    """
+    Returns whether parse_response_data gives the same output as legacy_parse_response_data, for both the given
+    requirements and the edge cases
+
+    Returns:
+        bool
+    """
+    for data in (requirements, generate_edge_case_requirements()):
+        if [x.to_dict() for x in ScenarioGetter.parse_response_data(data)] != legacy_parse_response_data(data):
+            return False
+    return True
+
+
+def generate_catch2_file(generator, scenarios, tabs=False):
+    """
+    Generates the Catch2 file for a list of scenarios, optionally indented with tabs
+
+    Parameters:
+        generator (Catch2CodeGenerator): the generator used to write the file
+        scenarios (list): parsed scenarios
+        tabs (bool): whether to indent with tabs rather than spaces
+
+    Returns:
+        str
+    """
+    file_text = generator.generate_new_scenarios(scenarios)
+    if tabs:
+        file_text = file_text.replace(generator.tab, "\t")
+    return file_text
+
+
+def generate_update_case(generator, count, depth, multiline, tabs, changed=0.1, missing=0.1):
+    """
+    Generates the inputs of an update: an existing file and a set of scenarios in which a fraction of the scenarios
+    have changed since the file was generated, and a fraction are not in the file at all
+
+    Returns:
+        tuple
+    """
+    scenarios = ScenarioGetter.parse_response_data(generate_requirements(count, depth, multiline))
+    in_file = scenarios[:count - int(count * missing)]
+    file_text = generate_catch2_file(generator, in_file, tabs)
+
+    # Changed scenarios lose their last statement and have their first statement reworded
+    step = int(1 / changed) if changed else 0
+    updated = []
+    for i, scenario in enumerate(scenarios):
+        if step and i % step == 0:
+            statements = list(scenario.statements[:-1] or scenario.statements)
+            statements[0] = Statement(statements[0].bdd_type, statements[0].text + " (changed)")
+            scenario = Scenario(scenario.id, tuple(statements))
+        updated.append(scenario)
+    return updated, file_text
+
+
+def measure(function, repeat):
+    """
+    Runs a function repeatedly and returns its best and mean times, then runs it once more under tracemalloc to
+    find its peak memory use
+
+    Returns:
+        dict
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"best_seconds": min(times), "mean_seconds": sum(times) / len(times), "peak_memory_bytes": peak}
+
+
+def run_benchmarks(counts, depth, multiline, tabs, repeat):
+    generator = Catch2CodeGenerator()
+    results = []
+
+    for count in counts:
+        case = {"scenarios": count, "depth": depth, "multiline": multiline, "tabs": tabs}
+        requirements = generate_requirements(count, depth, multiline)
+        scenarios = ScenarioGetter.parse_response_data(requirements)
+        updated, file_text = generate_update_case(generator, count, depth, multiline, tabs)
+        unchanged, unchanged_text = generate_update_case(generator, count, depth, multiline, tabs, 0, 0)
+
+        case["parse_identical"] = verify_parser(requirements)
+        if not case["parse_identical"]:
+            print("parse_response_data output differs from the legacy parser", file=sys.stderr)
+
+        benchmarks = {
+            "parse_response_data": lambda: ScenarioGetter.parse_response_data(requirements),
+            "legacy_parse_response_data": lambda: legacy_parse_response_data(requirements),
+            "generate_new_scenarios": lambda: generator.generate_new_scenarios(scenarios),
+            "update_existing_scenarios": lambda: generator.update_existing_scenarios(updated, file_text),
+            "update_unchanged_scenarios": lambda: generator.update_existing_scenarios(unchanged, unchanged_text)
+        }
+        for name, function in benchmarks.items():
+            result = dict(case, benchmark=name, repeat=repeat)
+            result.update(measure(function, repeat))
+            result["scenarios_per_second"] = count / result["best_seconds"] if result["best_seconds"] else None
+            if name == "update_existing_scenarios":
+                result["file_bytes"] = len(file_text.encode("utf-8"))
+            elif name == "update_unchanged_scenarios":
+                result["file_bytes"] = len(unchanged_text.encode("utf-8"))
+            results.append(result)
+            print("{benchmark:<28}{scenarios:>8} scenarios  {best_seconds:10.4f}s  {peak_memory_bytes:>12} bytes"
+                  .format(**result), file=sys.stderr)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """
+    Prints the ratio of each result's best time and peak memory to the matching result in a previous run
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    def key(x):
+        return x["benchmark"], x["scenarios"], x["depth"], x["multiline"], x["tabs"]
+
+    previous = {key(x): x for x in baseline["results"]}
+    for result in results:
+        before = previous.get(key(result))
+        if before is None or not before["best_seconds"]:
+            continue
+        print("{:<28}{:>8} scenarios  time x{:.2f}  memory x{:.2f}".format(
+            result["benchmark"], result["scenarios"], result["best_seconds"] / before["best_seconds"],
+            result["peak_memory_bytes"] / max(before["peak_memory_bytes"], 1)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parsing, generation and update of BDD scenarios")
+    parser.add_argument("--scenarios", default="100,1000,10000", help="comma separated scenario counts")
+    parser.add_argument("--depth", type=int, default=3, help="statements after SCENARIO in each scenario")
+    parser.add_argument("--multiline", type=float, default=0.0, help="fraction of statements spanning two lines")
+    parser.add_argument("--tabs", action="store_true", help="indent existing files with tabs")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each benchmark")
+    parser.add_argument("--output", help="file to write the JSON results to, rather than stdout")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    counts = [int(x) for x in args.scenarios.split(",")]
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "results": run_benchmarks(counts, args.depth, args.multiline, args.tabs, args.repeat)
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.compare:
+        compare(report["results"], args.compare)
@@ -0,0 +1,134 @@
+import re
+
+
+class Section():
+    """
+    A BDD section of a Catch2 file, e.g. a SCENARIO or a GIVEN, and the sections nested within its block. Offsets are
+    indexes into the parsed string:
+
+        start       the first character of the keyword
+        header_end  one past the ')' that closes the statement's arguments
+        body_start  the '{' opening the statement's block
+        end         one past the '}' closing the block, or None if the block is never closed
+    """
+    __slots__ = ("keyword", "start", "header_end", "body_start", "end", "tags", "children")
+
+    def __init__(self, keyword, start, header_end, body_start, tags):
+        self.keyword = keyword
+        self.start = start
+        self.header_end = header_end
+        self.body_start = body_start
+        self.end = None
+        self.tags = tags
+        self.children = []
+
+    def walk(self):
+        """
+        Returns this section followed by every section nested within it, in the order they appear in the file
+
+        Returns:
+            list
+        """
+        sections = []
+        stack = [self]
+        while stack:
+            section = stack.pop()
+            sections.append(section)
+            stack.extend(reversed(section.children))
+        return sections
+
+
+class Catch2Parser():
+    def __init__(self, keywords):
+        keywords_regex = '|'.join(sorted(keywords, key=len, reverse=True))
+
+        # Everything the parser needs to look at. Comments, string and character literals are matched whole so that
+        # any braces, brackets or keywords within them are skipped over. Digit separators (1'000) are not char literals.
+        # Leading whitespace is consumed as part of each token rather than tried against every alternative
+        self._token_pattern = re.compile(
+            r'\s*(?:(?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))'
+            r'|(?P<raw>(?:u8|[uUL])?R"(?P<delim>[^()\\\s"]{0,16})\(.*?\)(?P=delim)")'
+            r'|(?P<string>(?:u8|[uUL])?"(?:\\.|[^"\\])*(?:"|\Z))'
+            r"|(?P<char>(?<![0-9A-Za-z_])'(?:\\.|[^'\\\n])*')"
+            r'|(?P<keyword>(?<![0-9A-Za-z_])(?:' + keywords_regex + r')(?![0-9A-Za-z_]))'
+            r'|(?P<identifier>[A-Za-z_][0-9A-Za-z_]*)'
+            r'|(?P<open_paren>\()|(?P<close_paren>\))|(?P<open>\{)|(?P<close>\})|(?P<other>[^\s]))',
+            re.DOTALL)
+        self._tag_pattern = re.compile(r'\[([^\[\]]+)\]')
+
+    def parse(self, text):
+        """
+        Parses the contents of a Catch2 file in a single pass and returns the outermost BDD sections, each holding the
+        sections nested within it. Braces that are not the block of a BDD statement are tracked for nesting only
+
+        Parameters:
+            text (str): the contents of a Catch2 file
+
+        Returns:
+            list
+        """
+        roots = []
+        open_blocks = []
+        enclosing = []
+
+        # State of the BDD statement currently being read: its keyword, how deep into its arguments we are, the
+        # string literals within its arguments, and where its closing ')' was
+        keyword = None
+        paren_depth = 0
+        arguments = []
+        header_end = None
+
+        for token in self._token_pattern.finditer(text):
+            kind = token.lastgroup
+
+            if kind == "comment":
+                continue
+
+            if keyword is not None:
+                if header_end is None:
+                    if kind == "open_paren":
+                        paren_depth += 1
+                        continue
+                    if paren_depth == 0:
+                        # The keyword was not followed by an argument list, so it is not a statement
+                        keyword = None
+                    elif kind == "close_paren":
+                        paren_depth -= 1
+                        if paren_depth == 0:
+                            header_end = token.end()
+                        continue
+                    else:
+                        if kind in ("string", "raw") and paren_depth == 1:
+                            arguments.append(token.group(kind))
+                        if kind not in ("open", "close"):
+                            continue
+                        # Unbalanced braces within a statement's arguments mean this is not a statement
+                        keyword = None
+                elif kind == "open":
+                    # Catch2 tags are the last string argument, e.g. SCENARIO("name", "[tag]")
+                    tags = self._tag_pattern.findall(arguments[-1]) if len(arguments) > 1 else []
+                    section = Section(keyword[0], keyword[1], header_end, token.start(kind), tags)
+                    if enclosing:
+                        enclosing[-1].children.append(section)
+                    else:
+                        roots.append(section)
+                    enclosing.append(section)
+                    open_blocks.append(section)
+                    keyword = None
+                    continue
+                else:
+                    keyword = None
+
+            if kind == "keyword":
+                keyword = (token.group(kind), token.start(kind))
+                paren_depth = 0
+                arguments = []
+                header_end = None
+            elif kind == "open":
+                open_blocks.append(None)
+            elif kind == "close" and open_blocks:
+                section = open_blocks.pop()
+                if section is not None:
+                    section.end = token.end()
+                    enclosing.pop()
+        return roots
@@ -0,0 +1,122 @@
+"""
+gzip compression of request and response bodies. Request bodies sent with "Content-Encoding: gzip" are decompressed
+before they are parsed, and responses are compressed for clients that accept gzip
+"""
+import gzip
+import json
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+
+def get_max_body_size(compression_settings):
+    """
+    Returns the largest request body, in bytes, accepted by either server, before or after decompression
+
+    Parameters:
+        compression_settings (dict): the "compression" section of Settings.yaml
+
+    Returns:
+        int
+    """
+    return int(compression_settings.get("max_body_megabytes", 16) * 1024 * 1024)
+
+
+def decompress_gzip(body, max_size):
+    """
+    Decompresses a gzip body, which may hold several members, without ever holding more than max_size bytes of
+    output, so a small body cannot decompress to an unbounded size
+
+    Parameters:
+        body (bytes): the compressed body
+        max_size (int): the largest decompressed size allowed, or None for no limit
+
+    Returns:
+        bytes
+    """
+    output = []
+    size = 0
+    while body:
+        # wbits=31 reads a gzip rather than zlib stream
+        decompressor = zlib.decompressobj(31)
+        data = decompressor.decompress(body, max_size - size + 1 if max_size is not None else 0)
+        size += len(data)
+        if max_size is not None and size > max_size:
+            raise RequestEntityTooLarge("Request body is larger than {} bytes once decompressed".format(max_size))
+        if not decompressor.eof:
+            raise EOFError("Truncated gzip body")
+        output.append(data)
+        body = decompressor.unused_data
+    return b"".join(output)
+
+
+def read_json_body(request):
+    """
+    Returns the JSON body of a request, decompressing it first if it was sent gzip compressed. The body must be no
+    larger than the app's MAX_CONTENT_LENGTH both as sent and once decompressed, otherwise a 413 is returned
+
+    Parameters:
+        request (flask.Request): the request being handled
+
+    Returns:
+        dict
+    """
+    body = request.get_data()
+    try:
+        if request.headers.get("Content-Encoding", "").lower() == "gzip":
+            body = decompress_gzip(body, request.max_content_length)
+        data = json.loads(body or b"{}")
+    except (OSError, EOFError, zlib.error, ValueError):
+        raise BadRequest("Request body is not valid JSON, or not valid gzip when sent with Content-Encoding: gzip")
+    if not isinstance(data, dict):
+        raise BadRequest("Request body must be a JSON object")
+    return data
+
+
+class ResponseCompressor():
+    def __init__(self, compression_settings):
+        self._enabled = compression_settings.get("enabled", True)
+        self._min_size = compression_settings.get("min_size", 1024)
+        self._level = compression_settings.get("level", 6)
+
+    def compress(self, request, response):
+        """
+        Compresses a response if the client accepts gzip. Streamed responses are compressed as they are streamed,
+        others only if they are at least min_size bytes
+
+        Parameters:
+            request (flask.Request): the request being handled
+            response (flask.Response): the response to it
+
+        Returns:
+            flask.Response
+        """
+        if not self._enabled or "gzip" not in request.headers.get("Accept-Encoding", "").lower():
+            return response
+        if response.status_code < 200 or response.status_code >= 300 or "Content-Encoding" in response.headers:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response)
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < self._min_size:
+                return response
+            response.set_data(gzip.compress(body, compresslevel=self._level))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def compress_stream(self, chunks):
+        # wbits=31 gives a gzip rather than zlib stream
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            # Flush each chunk so the client receives scenarios as they are generated
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -0,0 +1,202 @@
+"""
+Updates every Catch2 file in a source tree from a page's scenarios. Each file is parsed once in a pool of worker
+processes, which updates the scenarios it holds and reports where each scenario was found, building an index of
+scenario IDs across the tree. Changed files are written atomically. Scenarios found in no file are added to a target
+file, and the results are combined into one report:
+
+    python directory_update.py --space SPACE --page "Page name" --root ../tests --target bdd/new_scenarios.cpp
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from bdd_generator import Catch2CodeGenerator, ScenarioGetter, load_config
+
+DEFAULT_EXTENSIONS = (".cpp", ".cc", ".cxx", ".hpp", ".h")
+
+# Set in each worker process by init_worker, so the scenarios are sent to a worker once rather than with every file
+worker_scenarios = None
+worker_scenario_ids = None
+worker_generator = None
+
+
+def init_worker(scenarios):
+    global worker_scenarios, worker_scenario_ids, worker_generator
+    worker_scenarios = scenarios
+    worker_scenario_ids = {x.id for x in scenarios}
+    worker_generator = Catch2CodeGenerator()
+
+
+def find_source_files(root, extensions=DEFAULT_EXTENSIONS):
+    """
+    Returns the path of every file under a directory with one of the extensions, skipping hidden directories
+
+    Parameters:
+        root (str): the directory to search
+        extensions (tuple): file extensions to include
+
+    Returns:
+        list
+    """
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(x for x in subdirectories if not x.startswith("."))
+        paths.extend(os.path.join(directory, x) for x in sorted(files) if x.endswith(tuple(extensions)))
+    return paths
+
+
+def write_atomically(path, text):
+    """
+    Writes a file through a temporary file in the same directory, which is then renamed over it, so the file is
+    never left partly written. The original file's permissions are kept
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".")
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(temporary_path, os.stat(path).st_mode & 0o7777)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def update_source_file(path, dry_run=False):
+    """
+    Updates the scenarios held in one file. Runs in the worker processes
+
+    Parameters:
+        path (str): the file to update
+        dry_run (bool): whether to leave the file unchanged
+
+    Returns:
+        dict: the file's path, the line of each of the page's scenarios found in it, and which of them were updated
+    """
+    with open(path, 'r') as f:
+        file_string = f.read().replace("\t", "    ")
+
+    # The file is parsed once. Its index gives both the report's locations and the blocks to update
+    index = worker_generator.index_scenarios(file_string)
+    edits = []
+    updated = []
+    for scenario in worker_scenarios:
+        block = index.get(scenario.id)
+        if block is None:
+            continue
+        scenario_edits = worker_generator.get_scenario_edits(scenario, block, file_string)
+        if scenario_edits:
+            edits.extend(scenario_edits)
+            updated.append(scenario.id)
+
+    if edits and not dry_run:
+        write_atomically(path, worker_generator.apply_edits(file_string, edits).rstrip())
+
+    # Line numbers are counted in one pass through the file. The index holds every Catch2 tag, e.g. [smoke], so only
+    # the page's scenario IDs are reported
+    lines = {}
+    line = 1
+    position = 0
+    blocks = [(x, block) for x, block in index.items() if x in worker_scenario_ids]
+    for scenario_id, block in sorted(blocks, key=lambda x: x[1].start):
+        line += file_string.count("\n", position, block.start)
+        position = block.start
+        lines[scenario_id] = line
+
+    return {"path": path, "lines": lines, "updated": updated}
+
+
+def update_directory(scenarios, root, target, extensions=DEFAULT_EXTENSIONS, workers=None, dry_run=False):
+    """
+    Updates every source file under a directory and adds scenarios found in none of them to a target file
+
+    Parameters:
+        scenarios (list): scenarios from ScenarioGetter.get_requirements
+        root (str): the source tree to update
+        target (str): the file, relative to root, that missing scenarios are added to. It is created if needed
+        extensions (tuple): extensions of the files to update
+        workers (int): worker processes to use, or None for one per core. With 1, files are updated in this process
+        dry_run (bool): whether to report the changes without writing them
+
+    Returns:
+        dict
+    """
+    paths = find_source_files(root, extensions)
+    if workers == 1 or len(paths) <= 1:
+        init_worker(scenarios)
+        results = [update_source_file(x, dry_run) for x in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(scenarios,)) as executor:
+            results = list(executor.map(update_source_file, paths, [dry_run] * len(paths)))
+
+    # Scenario ID -> every file and line it was found at, for the page's scenarios
+    index = {}
+    files = {}
+    for result in results:
+        relative_path = os.path.relpath(result["path"], root)
+        for scenario_id, line in result["lines"].items():
+            index.setdefault(scenario_id, []).append({"file": relative_path, "line": line})
+        if result["updated"]:
+            files[relative_path] = result["updated"]
+
+    generator = Catch2CodeGenerator()
+    missing = [x for x in scenarios if x.id not in index]
+    target_path = os.path.join(root, target)
+    if missing and not dry_run:
+        if os.path.isfile(target_path):
+            with open(target_path, 'r') as f:
+                target_text = generator.update_existing_scenarios(missing, f.read())[0]
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+            target_text = generator.generate_new_scenarios(missing)
+        write_atomically(target_path, target_text)
+
+    updated = {x for ids in files.values() for x in ids}
+    return {
+        "root": root,
+        "files_searched": len(paths),
+        "files_updated": files,
+        "target": target,
+        "updated": [x.id for x in scenarios if x.id in updated],
+        "missing": [x.id for x in missing],
+        "unchanged": [x.id for x in scenarios if x.id in index and x.id not in updated],
+        "duplicates": {x: locations for x, locations in index.items() if len(locations) > 1},
+        "index": index
+    }
+
+
+if __name__ == "__main__":
+    settings = load_config('Settings.yaml').get("directory_update", {})
+
+    parser = argparse.ArgumentParser(description="Update every Catch2 file in a source tree from a Confluence page")
+    parser.add_argument("--space", required=True, help="the key of the Confluence space")
+    parser.add_argument("--page", required=True, help="the Confluence page name")
+    parser.add_argument("--root", required=True, help="the source tree to update")
+    parser.add_argument("--target", default=settings.get("target", "new_scenarios.cpp"),
+                        help="file, relative to the root, that scenarios missing from every file are added to")
+    parser.add_argument("--extensions", default=",".join(settings.get("extensions") or DEFAULT_EXTENSIONS),
+                        help="comma separated extensions of the files to update")
+    parser.add_argument("--workers", type=int, default=settings.get("workers"), help="worker processes to use")
+    parser.add_argument("--dry-run", action="store_true", help="report the changes without writing them")
+    parser.add_argument("--output", help="file to write the JSON report to, rather than stdout")
+    args = parser.parse_args()
+
+    scenarios = ScenarioGetter().get_requirements(args.space, args.page)
+    report = update_directory(scenarios, args.root, args.target, tuple(args.extensions.split(",")), args.workers,
+                              args.dry_run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    print("{} updated, {} added to {}, {} unchanged in {} files".format(
+        len(report["updated"]), len(report["missing"]), args.target, len(report["unchanged"]),
+        report["files_searched"]), file=sys.stderr)
@@ -28,3 +28,15 @@ class ConfluenceError(Exception):
 
 class ProxyEnvError(Exception):
     pass
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class JobWorkerLostError(Exception):
+    pass
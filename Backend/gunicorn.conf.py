@@ -0,0 +1,27 @@
+"""
+gunicorn settings for the backend. Worker processes and the threads in each can be set with the WORKERS and THREADS
+environment variables. Each worker has its own scenario cache, while background jobs and metrics are shared through
+the job and metrics directories set in Config/Settings.yaml
+"""
+import multiprocessing
+import os
+import time
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "8002")
+workers = int(os.environ.get("WORKERS", multiprocessing.cpu_count()))
+# Read by each worker to size its /generate-batch process pool, so the pools share the cores between them
+os.environ["SERVER_WORKERS"] = str(workers)
+# Read by each worker so /metrics combines the workers of this run only, not those of an earlier run
+os.environ["SERVER_STARTED"] = str(time.time())
+threads = int(os.environ.get("THREADS", 4))
+worker_class = "gthread"
+
+# Updates of large files can take a while, and "new" output is streamed
+timeout = int(os.environ.get("TIMEOUT", 120))
+keepalive = 5
+
+# The app is created in each worker after it is forked, so no threads or connections are shared between workers
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
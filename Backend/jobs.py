@@ -0,0 +1,298 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import errors
+import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class CancelFlag():
+    """
+    Set to ask a job to stop at its next check. When jobs are shared through a directory, a job can also be
+    cancelled by another process creating its marker file
+    """
+
+    def __init__(self, marker_path=None):
+        self._event = threading.Event()
+        self._marker_path = marker_path
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        if not self._event.is_set() and self._marker_path is not None and os.path.exists(self._marker_path):
+            self._event.set()
+        return self._event.is_set()
+
+
+class Job():
+    __slots__ = ("id", "state", "created", "started", "finished", "result", "error", "cancelled", "future")
+
+    def __init__(self, job_id=None, cancelled=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancelled = cancelled or CancelFlag()
+        self.future = None
+
+    def status(self):
+        return {
+            "id": self.id,
+            "status": self.state,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "cancel_requested": self.cancelled.is_set()
+        }
+
+    def to_dict(self):
+        return dict(self.status(), result=self.result, error=self.error)
+
+    @classmethod
+    def from_dict(cls, data, cancelled):
+        job = cls(data["id"], cancelled)
+        job.state = data["status"]
+        job.created = data["created"]
+        job.started = data["started"]
+        job.finished = data["finished"]
+        job.result = data["result"]
+        job.error = data["error"]
+        return job
+
+
+class JobManager():
+    """
+    Runs jobs in a bounded pool of background threads. Up to queue_depth jobs wait for a free worker, and further
+    submissions are refused with JobQueueFullError until there is room. Finished jobs are kept for result_ttl seconds
+    so their results can be collected.
+
+    Jobs are held in memory by the process that runs them. When a directory is configured, each job's state is also
+    written there, so that any worker process of a multi-process server can report on or cancel any job. The process
+    touches the files of its unfinished jobs every heartbeat seconds, and a job whose file has not been touched for
+    three heartbeats is reported as failed, since the process running it must have died
+    """
+
+    def __init__(self, job_settings, format_error=str):
+        self._workers = job_settings.get("workers", 4)
+        self._queue_depth = job_settings.get("queue_depth", 32)
+        self._result_ttl = job_settings.get("result_ttl", 600)
+        self._heartbeat = job_settings.get("heartbeat", 10)
+        self._directory = None
+        if job_settings.get("directory"):
+            self._directory = os.path.join(os.path.dirname(__file__), job_settings["directory"])
+            os.makedirs(self._directory, exist_ok=True)
+        # Turns the exception raised by a failed job into the error reported for it
+        self._format_error = format_error
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        if self._directory is not None:
+            threading.Thread(target=self.beat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, function, *args):
+        """
+        Queues a job. The function is called with the job's CancelFlag followed by args, and should check the flag
+        between steps, raising JobCancelledError once it is set
+
+        Parameters:
+            function (function): the work to run
+            args: further arguments to the function
+
+        Returns:
+            Job
+        """
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, CancelFlag(self.get_path(job_id, ".cancel")))
+        with self._lock:
+            self.remove_expired()
+            active = sum(1 for x in self._jobs.values() if x.state not in FINISHED_STATES)
+            if active >= self._workers + self._queue_depth:
+                raise errors.JobQueueFullError
+            self._jobs[job.id] = job
+            self.save(job)
+            job.future = self._executor.submit(self.run, job, function, args)
+        return job
+
+    def run(self, job, function, args):
+        with self._lock:
+            if job.state != QUEUED:
+                return
+            job.state = RUNNING
+            job.started = time.time()
+            self.save(job)
+        metrics.STAGE_SECONDS.observe(job.started - job.created, stage="queue")
+        try:
+            if job.cancelled.is_set():
+                raise errors.JobCancelledError
+            result = function(job.cancelled, *args)
+        except errors.JobCancelledError:
+            self.finish(job, CANCELLED)
+        except Exception as e:
+            job.error = self._format_error(e)
+            self.finish(job, FAILED)
+        else:
+            job.result = result
+            self.finish(job, SUCCEEDED)
+
+    def finish(self, job, state):
+        with self._lock:
+            job.state = state
+            job.finished = time.time()
+            self.save(job)
+
+    def get(self, job_id):
+        """
+        Returns a job, or None if there is no job with the ID or it has expired
+
+        Parameters:
+            job_id (str): the ID returned when the job was submitted
+
+        Returns:
+            Job
+        """
+        with self._lock:
+            self.remove_expired()
+            job = self._jobs.get(job_id)
+            if job is not None and job.state in FINISHED_STATES and not self.is_saved(job_id):
+                # Another process deleted the finished job, so it is gone here too
+                del self._jobs[job_id]
+                return None
+        if job is None:
+            job = self.load(job_id)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. A queued job is cancelled straight away and a running job at its next check. A finished job is
+        removed along with its result
+
+        Parameters:
+            job_id (str): the ID returned when the job was submitted
+
+        Returns:
+            Job, or None if there is no job with the ID
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                if job.state == QUEUED:
+                    job.future.cancel()
+                    job.state = CANCELLED
+                    job.finished = time.time()
+                    self.save(job)
+                elif job.state == RUNNING:
+                    job.cancelled.set()
+                else:
+                    del self._jobs[job_id]
+                    self.delete(job_id)
+                return job
+
+        # A job run by another process is cancelled through its marker file
+        job = self.load(job_id)
+        if job is None:
+            return None
+        if job.state in FINISHED_STATES:
+            self.delete(job_id)
+        else:
+            with open(self.get_path(job_id, ".cancel"), 'w'):
+                pass
+        return job
+
+    def beat(self):
+        # Runs for the life of the process, so that other processes can tell its jobs from those of a dead process
+        while True:
+            time.sleep(self._heartbeat)
+            with self._lock:
+                for job in self._jobs.values():
+                    if job.state not in FINISHED_STATES:
+                        try:
+                            os.utime(self.get_path(job.id))
+                        except OSError:
+                            pass
+
+    def get_path(self, job_id, extension=".json"):
+        if self._directory is None:
+            return None
+        return os.path.join(self._directory, job_id + extension)
+
+    def save(self, job):
+        # Written to a temporary file and renamed, so other processes never read a partly written job
+        path = self.get_path(job.id)
+        if path is None:
+            return
+        with open(path + ".tmp", 'w') as f:
+            json.dump(job.to_dict(), f)
+        os.replace(path + ".tmp", path)
+
+    def is_saved(self, job_id):
+        path = self.get_path(job_id)
+        return path is None or os.path.exists(path)
+
+    def load(self, job_id):
+        path = self.get_path(job_id)
+        # IDs are only ever hex strings, so any other ID cannot name a file outside the directory
+        if path is None or not job_id.isalnum():
+            return None
+        try:
+            with open(path, 'r') as f:
+                job = Job.from_dict(json.load(f), CancelFlag(self.get_path(job_id, ".cancel")))
+                touched = os.fstat(f.fileno()).st_mtime
+        except (OSError, ValueError):
+            return None
+        if job.state not in FINISHED_STATES and touched < time.time() - 3 * self._heartbeat:
+            # The process running the job died without finishing it
+            job.state = FAILED
+            job.finished = touched
+            job.error = self._format_error(errors.JobWorkerLostError())
+            self.save(job)
+        if job.finished is not None and job.finished < time.time() - self._result_ttl:
+            # The process that ran the job may have stopped before removing it
+            self.delete(job_id)
+            return None
+        return job
+
+    def delete(self, job_id):
+        for extension in (".json", ".cancel"):
+            path = self.get_path(job_id, extension)
+            if path is not None and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def remove_expired(self):
+        # Called with the lock held
+        expired_before = time.time() - self._result_ttl
+        for job_id in [x.id for x in self._jobs.values() if x.finished is not None and x.finished < expired_before]:
+            del self._jobs[job_id]
+            self.delete(job_id)
+
+    def stats(self):
+        """
+        Returns the number of this process's jobs in each state, and the pool's size and queue depth
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            stats = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                stats[job.state] += 1
+            stats["workers"] = self._workers
+            stats["queue_depth"] = self._queue_depth
+            return stats
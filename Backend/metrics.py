@@ -0,0 +1,330 @@
+"""
+Counters and histograms exported in the Prometheus text format. Values are kept per process, and a MetricsStore
+combines those of a multi-process server's workers
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+
+
+class Counter():
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[x]) for x in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def collect(self, values=None):
+        # values, from merge_values, replace this process's own when metrics are combined across processes
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} counter".format(self.name)]
+        with self._lock:
+            for key, value in sorted((self._values if values is None else values).items()):
+                lines.append("{}{} {}".format(self.name, format_labels(self.labelnames, key), value))
+        return lines
+
+
+class Histogram():
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[x]) for x in self.labelnames)
+        with self._lock:
+            # Bucket counts are stored per bucket and made cumulative when collected
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the time taken by the body of a with statement
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def time_iterable(self, iterable, **labels):
+        """
+        Yields from an iterable, observing the total time spent producing its items once it is exhausted or closed
+        """
+        elapsed = 0.0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    return
+                elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.observe(elapsed, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(counts)] for key, counts in self._values.items()]
+
+    def collect(self, values=None):
+        # values, from merge_values, replace this process's own when metrics are combined across processes
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            for key, counts in sorted((self._values if values is None else values).items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append("{}_bucket{} {}".format(
+                        self.name, format_labels(self.labelnames + ("le",), key + (repr(bound),)), cumulative))
+                lines.append("{}_bucket{} {}".format(
+                    self.name, format_labels(self.labelnames + ("le",), key + ("+Inf",)), counts[-2]))
+                lines.append("{}_count{} {}".format(self.name, format_labels(self.labelnames, key), counts[-2]))
+                lines.append("{}_sum{} {}".format(self.name, format_labels(self.labelnames, key), counts[-1]))
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+        pairs.append('{}="{}"'.format(name, value))
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_gauges(name, documentation, values):
+    """
+    Formats a set of point-in-time values, e.g. cache statistics, as a labelled gauge
+
+    Parameters:
+        name (str): the metric name
+        documentation (str): the metric's help text
+        values (dict): maps each label value to its number
+
+    Returns:
+        list
+    """
+    lines = ["# HELP {} {}".format(name, documentation), "# TYPE {} gauge".format(name)]
+    for key, value in sorted(values.items()):
+        lines.append("{}{} {}".format(name, format_labels(("stat",), (key,)), value))
+    return lines
+
+
+def format_process_gauges(name, documentation, process_values):
+    """
+    Formats the point-in-time values of several processes as a gauge labelled with each process's ID
+
+    Parameters:
+        name (str): the metric name
+        documentation (str): the metric's help text
+        process_values (list): (pid, values) for each process, where values maps each label value to its number
+
+    Returns:
+        list
+    """
+    lines = ["# HELP {} {}".format(name, documentation), "# TYPE {} gauge".format(name)]
+    for pid, values in sorted(process_values, key=lambda x: x[0]):
+        for key, value in sorted(values.items()):
+            lines.append("{}{} {}".format(name, format_labels(("pid", "stat"), (str(pid), key)), value))
+    return lines
+
+
+def merge_values(snapshots):
+    """
+    Adds up the values that several processes' snapshots hold for a metric. Histogram bucket counts are added bucket
+    by bucket
+
+    Parameters:
+        snapshots (list): the snapshot of the metric from each process
+
+    Returns:
+        dict
+    """
+    values = {}
+    for snapshot in snapshots:
+        for key, value in snapshot:
+            key = tuple(key)
+            if key not in values:
+                values[key] = value
+            elif isinstance(value, list):
+                values[key] = [x + y for x, y in zip(values[key], value)]
+            else:
+                values[key] += value
+    return values
+
+
+def operation_label(operation):
+    return operation if operation in KNOWN_OPERATIONS else "other"
+
+
+def render(extra_lines=()):
+    """
+    Returns every registered metric in the Prometheus text exposition format
+
+    Parameters:
+        extra_lines (list): further lines to include, e.g. from format_gauges
+
+    Returns:
+        str
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsStore():
+    """
+    Combines the metrics of a multi-process server's worker processes through a directory. Each process writes a
+    snapshot of its values there every interval seconds and whenever it renders its metrics, so any worker can report
+    for all of them. Counters and histograms are summed over every process of the current server run, including
+    processes that have since stopped, so they do not go back down when a worker is replaced. Gauges describe a
+    single process, so they are reported per process with a pid label, leaving out any process that has not written
+    for three intervals. Snapshots from an earlier run of the server are removed
+    """
+
+    def __init__(self, metrics_settings, get_gauges):
+        """
+        Parameters:
+            metrics_settings (dict): the metrics section of Settings.yaml, with the directory relative to Backend
+            get_gauges (function): returns the process's gauges as a list of (name, documentation, values)
+        """
+        self._directory = os.path.join(os.path.dirname(__file__), metrics_settings["directory"])
+        os.makedirs(self._directory, exist_ok=True)
+        self._interval = metrics_settings.get("interval", 10)
+        self._get_gauges = get_gauges
+        self._pid = os.getpid()
+        # Named per process rather than by PID, so a later worker given a stopped worker's PID keeps its counts
+        self._path = os.path.join(self._directory, "{}-{}.json".format(self._pid, uuid.uuid4().hex))
+        # Set by gunicorn.conf.py when the server starts, so it is shared by the workers of one run
+        self._run = os.environ.get("SERVER_STARTED") or str(time.time())
+        self._lock = threading.Lock()
+        threading.Thread(target=self.beat, name="metrics-writer", daemon=True).start()
+
+    def beat(self):
+        # Runs for the life of the process, so its latest values are counted when another worker renders
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.write(self._get_gauges())
+            except OSError:
+                pass
+
+    def write(self, gauges):
+        # Written to a temporary file and renamed, so other processes never read a partly written snapshot
+        snapshot = {
+            "run": self._run,
+            "pid": self._pid,
+            "written": time.time(),
+            "metrics": {x.name: x.snapshot() for x in _metrics},
+            "gauges": gauges
+        }
+        with self._lock:
+            with open(self._path + ".tmp", 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(self._path + ".tmp", self._path)
+
+    def read(self):
+        snapshots = []
+        for file_name in os.listdir(self._directory):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self._directory, file_name)
+            try:
+                with open(path, 'r') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get("run") != self._run:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self, gauges):
+        """
+        Returns the metrics of every worker process in the Prometheus text exposition format
+
+        Parameters:
+            gauges (list): this process's gauges as (name, documentation, values)
+
+        Returns:
+            str
+        """
+        self.write(gauges)
+        snapshots = self.read()
+        lines = []
+        for metric in _metrics:
+            lines.extend(metric.collect(merge_values(x["metrics"].get(metric.name, []) for x in snapshots)))
+        live_after = time.time() - 3 * self._interval
+        process_gauges = {}
+        for snapshot in snapshots:
+            if snapshot["written"] < live_after:
+                continue
+            for name, documentation, values in snapshot["gauges"]:
+                process_gauges.setdefault(name, (documentation, []))[1].append((snapshot["pid"], values))
+        for name, (documentation, process_values) in process_gauges.items():
+            lines.extend(format_process_gauges(name, documentation, process_values))
+        return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "bdd_generator_stage_seconds",
+    "Time spent in each stage of handling a request. The fetch stage includes parsing and cache hits",
+    ("stage",))
+CONFLUENCE_REQUEST_SECONDS = Histogram(
+    "bdd_generator_confluence_request_seconds",
+    "Time taken by each call to Confluence",
+    ("call",))
+OPERATIONS = Counter(
+    "bdd_generator_operations_total",
+    "Requests handled, by operation",
+    ("operation",))
+# Operations counted under their own label. Any other value sent by a client, including none, is counted as "other" so
+# that made up operations cannot add label series
+KNOWN_OPERATIONS = ("new", "update")
+ERRORS = Counter(
+    "bdd_generator_errors_total",
+    "Errors reported to users, by exception type",
+    ("type",))
+WEBHOOK_EVENTS = Counter(
+    "bdd_generator_webhook_events_total",
+    "Page updated webhook events accepted")
@@ -0,0 +1,110 @@
+"""
+A local stand-in for Confluence and Requirements Yogi, serving generated mock requirements so the real fetch path of
+ScenarioGetter can be run offline. Point Config/Credentials.yaml's url at the server and set
+confluence.use_mock_data to false in Config/Settings.yaml, then run:
+
+    python mock_confluence.py --count 5000 --port 8090
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from mock_data import generate_requirements
+
+REQUIREMENTS_PATH = "/rest/reqs/1/requirement2/"
+CONTENT_PATH = "/rest/api/content"
+
+
+class MockConfluenceHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if url.path.startswith(REQUIREMENTS_PATH):
+            self.send_json(self.get_requirements(params))
+        elif url.path.rstrip("/") == CONTENT_PATH:
+            self.send_json(self.get_content(params))
+        else:
+            self.send_error(404)
+
+    def get_requirements(self, params):
+        # Results are paged like Requirements Yogi, with the page size capped by the server
+        offset = int(params.get("offset", 0))
+        limit = min(int(params.get("limit", self.server.max_page_size)), self.server.max_page_size)
+        return {
+            "count": len(self.server.requirements),
+            "offset": offset,
+            "limit": limit,
+            "results": self.server.requirements[offset:offset + limit]
+        }
+
+    def get_content(self, params):
+        # Every page title exists in every space
+        page = {
+            "id": str(self.server.page_id),
+            "type": "page",
+            "title": params.get("title", ""),
+            "version": {"number": self.server.version}
+        }
+        return {"results": [page], "start": 0, "limit": 25, "size": 1}
+
+    def send_json(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockConfluenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, count=1000, max_page_size=100, delay=0.0, version=1, depth=3, multiline=0.0):
+        super().__init__(address, MockConfluenceHandler)
+        self.requirements = generate_requirements(count, depth, multiline)
+        self.max_page_size = max_page_size
+        self.delay = delay
+        self.version = version
+        self.page_id = 1000
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        """
+        Serves requests on a background thread and returns the server
+
+        Returns:
+            MockConfluenceServer
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve mock Confluence and Requirements Yogi data")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--count", type=int, default=1000, help="number of requirements on every page")
+    parser.add_argument("--depth", type=int, default=3, help="statements after SCENARIO in each requirement")
+    parser.add_argument("--multiline", type=float, default=0.0, help="fraction of statements spanning two lines")
+    parser.add_argument("--max-page-size", type=int, default=100, help="largest page of results returned")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument("--version", type=int, default=1, help="version number reported for every page")
+    args = parser.parse_args()
+
+    server = MockConfluenceServer((args.host, args.port), args.count, args.max_page_size, args.delay, args.version,
+                                  args.depth, args.multiline)
+    print("Serving {} requirements on {}".format(args.count, server.url))
+    server.serve_forever()
@@ -0,0 +1,113 @@
+import random
+
+# Keywords of generated statements, in nesting order
+STATEMENT_KEYWORDS = ["GIVEN", "WHEN", "THEN", "AND_GIVEN", "AND_WHEN", "AND_THEN"]
+
+# Requirements Yogi results used in place of a Confluence instance
+MOCK_REQUIREMENTS = [
+    {
+        'key': 'SCEN-1',
+        'properties': [
+            {
+                'key': 'Scenario',
+                'indexation':
+                    {
+                        'multivalues':
+                        [
+                            'SCENARIO("Mock scenario 1")',
+                            'GIVEN("Mock GIVEN statement for scenario 1")',
+                            'WHEN("Mock WHEN statement for scenario 1")',
+                            'THEN("Mock THEN statement for scenario 1")'
+                        ]
+                    }
+            }
+        ]
+    },
+    {
+        'key': 'SCEN-2',
+        'properties': [
+            {
+                'key': 'Scenario',
+                'indexation':
+                    {
+                        'multivalues': [
+                            'SCENARIO("Mock scenario 2")',
+                            'GIVEN("Mock GIVEN statement for scenario 2")',
+                            'WHEN("Mock WHEN statement for scenario 2")',
+                            'THEN("Mock THEN statement for scenario 2")'
+                        ]
+                    }
+            }
+        ]
+    },
+    {
+        'key': 'SCEN-3',
+        'properties': [
+            {
+                'key': 'Scenario',
+                'indexation':
+                {
+                    'multivalues': [
+                        'SCENARIO("Mock scenario 3")',
+                        'GIVEN("Mock GIVEN statement for scenario 3")',
+                        'WHEN(Mock WHEN statement for scenario 3")',
+                        'THEN("Mock THEN statement for scenario 3")'
+                    ]
+                }
+            }
+        ]
+    },
+    {
+        'key': 'SCEN-4',
+        'properties': [
+                {
+                    'key': 'Scenario',
+                    'indexation':
+                    {
+                        'multivalues': [
+                            'SCENARIO("Mock scenario 4")',
+                            'GIVEN("Mock GIVEN statement for scenario 4")',
+                            'WHEN("Mock WHEN statement for scenario 4")',
+                            'THEN("Mock THEN statement for scenario 4")'
+                        ]
+                    }
+            }
+        ]
+    }
+]
+
+
+def generate_requirements(count, depth=3, multiline=0.0, seed=0):
+    """
+    Generates Requirements Yogi results in the same shape as MOCK_REQUIREMENTS, for testing at scale
+
+    Parameters:
+        count (int): the number of requirements to generate
+        depth (int): the number of BDD statements after the SCENARIO statement of each requirement
+        multiline (float): the fraction of statements that continue onto a second line
+        seed (int): seeds the choice of multi-line statements, so the same arguments give the same results
+
+    Returns:
+        list
+    """
+    chooser = random.Random(seed)
+    requirements = []
+    for i in range(1, count + 1):
+        multivalues = ['SCENARIO("Mock scenario {}")'.format(i)]
+        for j in range(depth):
+            keyword = STATEMENT_KEYWORDS[j % len(STATEMENT_KEYWORDS)]
+            multivalues.append('{}("Mock {} statement for scenario {}")'.format(keyword, keyword, i))
+            if multiline and chooser.random() < multiline:
+                multivalues.append('continued over another line for scenario {}'.format(i))
+        requirements.append({
+            'key': 'SCEN-{}'.format(i),
+            'properties': [
+                {
+                    'key': 'Scenario',
+                    'indexation': {
+                        'multivalues': multivalues
+                    }
+                }
+            ]
+        })
+    return requirements
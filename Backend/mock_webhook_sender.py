@@ -0,0 +1,104 @@
+"""
+A local stand-in for Confluence's webhook sender. Sends a signed page_updated event to the backend for each page,
+waits for each refresh job to finish, then times a "new" request for the page, which should be served from the code
+generated by the refresh:
+
+    python mock_webhook_sender.py --url http://localhost:8002 --secret SECRET SPACE "Page name"
+"""
+import argparse
+import json
+import sys
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+import webhooks
+
+
+def page_updated_event(space, page, version=None):
+    """
+    Returns a page_updated event in Confluence's format
+
+    Returns:
+        dict
+    """
+    return {
+        "timestamp": int(time.time() * 1000),
+        "page": {"spaceKey": space, "title": page, "version": version}
+    }
+
+
+def send_event(url, event, secret=None):
+    """
+    Posts an event to the backend's webhook endpoint, signed with the secret if there is one
+
+    Returns:
+        tuple: the response's status code and JSON body
+    """
+    body = json.dumps(event).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[webhooks.SIGNATURE_HEADER] = webhooks.sign(secret, body)
+    return request_json(Request(url + "/webhooks/page-updated", data=body, headers=headers, method="POST"))
+
+
+def request_json(request):
+    try:
+        with urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def wait_for_job(url, job_id, timeout=60):
+    """
+    Polls a job until it has finished, then returns its result
+
+    Returns:
+        dict
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = request_json(Request(url + "/jobs/" + job_id))[1]
+        if status.get("status") not in ("queued", "running"):
+            return request_json(Request(url + "/jobs/" + job_id + "/result"))[1]
+        time.sleep(0.1)
+    raise TimeoutError("Job {} did not finish within {}s".format(job_id, timeout))
+
+
+def time_new_request(url, space, page):
+    """
+    Returns the seconds taken by a "new" request for a page, and the length of the code returned
+    """
+    query = urlencode({"space": space, "page": page, "operation": "new"})
+    start = time.perf_counter()
+    with urlopen(url + "/generate-data?" + query) as response:
+        body = response.read()
+    return time.perf_counter() - start, len(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send page_updated webhook events to the backend")
+    parser.add_argument("space", help="the key of the Confluence space")
+    parser.add_argument("pages", nargs="+", help="names of the updated pages")
+    parser.add_argument("--url", default="http://localhost:8002", help="the backend's URL")
+    parser.add_argument("--secret", help="the webhook secret set in Config/Settings.yaml")
+    parser.add_argument("--version", type=int, help="page version to report in the events")
+    parser.add_argument("--no-wait", action="store_true", help="send the events without waiting for the refreshes")
+    args = parser.parse_args()
+
+    failed = False
+    for page in args.pages:
+        status, body = send_event(args.url, page_updated_event(args.space, page, args.version), args.secret)
+        print("{} {}: {} {}".format(args.space, page, status, json.dumps(body)))
+        if status != 202:
+            failed = True
+            continue
+        if args.no_wait:
+            continue
+
+        print("  refresh: {}".format(json.dumps(wait_for_job(args.url, body["id"]))))
+        seconds, size = time_new_request(args.url, args.space, page)
+        print("  new request: {:.1f}ms, {} bytes".format(seconds * 1000, size))
+    sys.exit(1 if failed else 0)
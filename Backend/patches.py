@@ -0,0 +1,165 @@
+"""
+Line based patches, built from the (start, end, text) edits that Catch2CodeGenerator makes to a file. A patch is a list
+of [start, end, lines] edits, each replacing lines[start:end] of the original file. Working from the generator's edits
+rather than comparing the two files keeps the cost linear in the size of the file
+"""
+from bisect import bisect_right
+
+
+def ends_line(text):
+    """
+    Returns whether text ends with a line break, as str.splitlines sees it
+    """
+    return len((text + "x").splitlines()) > 1
+
+
+def line_edits(lines, normalised_lines, edits):
+    """
+    Converts edits made to a normalised copy of a file into edits to the lines of the original file. Lines that were
+    changed by normalisation but not edited are replaced by their normalised version
+
+    Parameters:
+        lines (list): the lines of the original file, from str.splitlines(keepends=True)
+        normalised_lines (list): the same lines after normalisation, e.g. with tabs replaced
+        edits (list): non-overlapping (start, end, text) edits with offsets into ''.join(normalised_lines)
+
+    Returns:
+        list
+    """
+    starts = [0]
+    for line in normalised_lines:
+        starts.append(starts[-1] + len(line))
+    total = starts[-1]
+    count = len(normalised_lines)
+
+    # Widen each edit to the whole lines it touches, merging edits that touch the same lines
+    hunks = []
+    for start, end, text in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+        if start == total and (not count or ends_line(normalised_lines[-1])):
+            first = last = count
+        else:
+            first = min(bisect_right(starts, start) - 1, count - 1)
+            last = min(bisect_right(starts, max(start, end - 1)), count)
+        if hunks and first < hunks[-1][1]:
+            hunks[-1][1] = max(hunks[-1][1], last)
+            hunks[-1][2].append((start, end, text))
+        else:
+            hunks.append([first, last, [(start, end, text)]])
+
+    hunks.append([count, count, None])
+    result = []
+    position = 0
+    index = 0
+    while True:
+        first, last, hunk_edits = hunks[index]
+        index += 1
+        # Lines only changed by normalisation are replaced as they are
+        changed = position
+        for i in range(position, first + 1):
+            if i == first or lines[i] == normalised_lines[i]:
+                if changed < i:
+                    result.append([changed, i, normalised_lines[changed:i]])
+                changed = i + 1
+        if hunk_edits is None:
+            break
+
+        # Only the last line of the file may be left without a line break, so a hunk that leaves its last line
+        # unfinished takes in the line after it, along with any hunk that touches that line
+        hunk_text = apply_hunk(normalised_lines, starts, first, last, hunk_edits)
+        while hunk_text and not ends_line(hunk_text) and last < count:
+            last += 1
+            while hunks[index][2] is not None and hunks[index][0] < last:
+                last = max(last, hunks[index][1])
+                hunk_edits = hunk_edits + hunks[index][2]
+                index += 1
+            hunk_text = apply_hunk(normalised_lines, starts, first, last, hunk_edits)
+        result.append([first, last, hunk_text.splitlines(keepends=True)])
+        position = last
+    return result
+
+
+def apply_hunk(normalised_lines, starts, first, last, edits):
+    # Applies edits, sorted and with offsets into the whole file, to normalised_lines[first:last]
+    segment = ''.join(normalised_lines[first:last])
+    pieces = []
+    offset = 0
+    for start, end, text in edits:
+        pieces.append(segment[offset:start - starts[first]])
+        pieces.append(text)
+        offset = end - starts[first]
+    pieces.append(segment[offset:])
+    return ''.join(pieces)
+
+
+def apply_line_edits(lines, edits):
+    """
+    Applies the edits from line_edits to the lines they were made against
+
+    Parameters:
+        lines (list): the lines of the original file, from str.splitlines(keepends=True)
+        edits (list): [start, end, lines] edits
+
+    Returns:
+        str
+    """
+    lines = list(lines)
+    for start, end, new_lines in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        lines[start:end] = new_lines
+    return ''.join(lines)
+
+
+def unified_diff(lines, edits, from_file="existing", to_file="updated", context=3):
+    """
+    Formats the edits from line_edits as a unified diff, in the same format as difflib.unified_diff
+
+    Parameters:
+        lines (list): the lines of the original file, from str.splitlines(keepends=True)
+        edits (list): [start, end, lines] edits
+        from_file (str): the name given to the original file
+        to_file (str): the name given to the edited file
+        context (int): lines of unchanged code shown around each change
+
+    Returns:
+        str
+    """
+    # Edits close enough for their context to overlap are shown in the same hunk
+    groups = []
+    for edit in edits:
+        if groups and edit[0] - groups[-1][-1][1] <= 2 * context:
+            groups[-1].append(edit)
+        else:
+            groups.append([edit])
+
+    diff = []
+    if groups:
+        diff.append("--- {}\n+++ {}\n".format(from_file, to_file))
+    shift = 0
+    for group in groups:
+        old_start = max(group[0][0] - context, 0)
+        old_end = min(group[-1][1] + context, len(lines))
+        group_shift = sum(len(x[2]) - (x[1] - x[0]) for x in group)
+        diff.append("@@ -{} +{} @@\n".format(format_range(old_start, old_end - old_start),
+                                             format_range(old_start + shift, old_end - old_start + group_shift)))
+        position = old_start
+        for start, end, new_lines in group:
+            diff.extend(format_line(" ", x) for x in lines[position:start])
+            diff.extend(format_line("-", x) for x in lines[start:end])
+            diff.extend(format_line("+", x) for x in new_lines)
+            position = end
+        diff.extend(format_line(" ", x) for x in lines[position:old_end])
+        shift += group_shift
+    return ''.join(diff)
+
+
+def format_range(start, length):
+    if length == 1:
+        return str(start + 1)
+    if not length:
+        return "{},0".format(start)
+    return "{},{}".format(start + 1, length)
+
+
+def format_line(prefix, line):
+    if ends_line(line):
+        return prefix + line
+    return prefix + line + "\n\\ No newline at end of file\n"
@@ -0,0 +1,89 @@
+"""
+Loads a list of pages into the persistent scenario store ahead of a deployment, so new workers start with every page
+already parsed. Pages are read from a file, or stdin with "-", one per line as the space key followed by the page
+name, with blank lines and lines starting with # ignored:
+
+    python prewarm.py pages.txt --concurrency 8
+
+The store must be the one the deployed backend reads. With docker-compose.yaml it is kept in the scenario_store
+volume, which the command can be run against:
+
+    docker compose run --rm -T backend python prewarm.py - < pages.txt
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bdd_generator import HANDLED_ERRORS, ErrorFormatter, ScenarioGetter
+
+
+def read_pages(path):
+    """
+    Reads a file of pages, one "SPACE Page name" per line
+
+    Parameters:
+        path (str): the file to read, or "-" for stdin
+
+    Returns:
+        list: (space, page) tuples
+    """
+    pages = []
+    with (open(path, 'r') if path != "-" else sys.stdin) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            space, _, page = line.partition(" ")
+            pages.append((space, page.strip()))
+    return pages
+
+
+def prewarm(getter, pages, concurrency=4):
+    """
+    Fetches each page through a ScenarioGetter, which stores its scenarios, and returns the outcome for each page
+
+    Parameters:
+        getter (ScenarioGetter): a getter with the persistent store enabled
+        pages (list): (space, page) tuples
+        concurrency (int): pages fetched at once
+
+    Returns:
+        list: (space, page, scenario count or None, error message or None) tuples
+    """
+    formatter = ErrorFormatter()
+
+    def load(space, page):
+        try:
+            return space, page, len(getter.get_requirements(space, page)), None
+        except HANDLED_ERRORS as e:
+            return space, page, None, formatter.generate_exception_error(e)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="prewarm") as executor:
+        return list(executor.map(lambda x: load(*x), pages))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load pages into the persistent scenario store")
+    parser.add_argument("pages", help="file listing one \"SPACE Page name\" per line, or - for stdin")
+    parser.add_argument("--concurrency", type=int, default=4, help="pages fetched at once")
+    args = parser.parse_args()
+
+    getter = ScenarioGetter()
+    if getter.cache_stats().get("store_max_bytes") is None:
+        parser.error("the scenario store is not enabled in Config/Settings.yaml")
+
+    start = time.perf_counter()
+    results = prewarm(getter, read_pages(args.pages), args.concurrency)
+    for space, page, count, error in results:
+        if error is None:
+            print("{}\t{}\t{} scenarios".format(space, page, count))
+        else:
+            print("{}\t{}\t{}".format(space, page, error.replace("\n", " ")), file=sys.stderr)
+
+    failed = sum(1 for x in results if x[3] is not None)
+    stats = getter.cache_stats()
+    print("Loaded {} of {} pages in {:.1f}s. The store holds {} pages, {} bytes".format(
+        len(results) - failed, len(results), time.perf_counter() - start, stats["store_pages"], stats["store_bytes"]),
+        file=sys.stderr)
+    sys.exit(1 if failed else 0)
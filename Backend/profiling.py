@@ -0,0 +1,111 @@
+"""
+Opt-in profiling of /generate-data requests. When enabled in Config/Settings.yaml, a request with an X-Profile: 1
+header or a profile=1 query parameter is run under cProfile, and the profile is saved to the profiling directory
+alongside a capture of the request's input. A capture can be replayed offline through Catch2CodeGenerator:
+
+    python profiling.py profiles/20240101-120000-1a2b3c4d.json --repeat 5
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import time
+import uuid
+
+from scenario_model import Scenario
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_PARAMETER = "profile"
+
+
+class RequestProfiler():
+    def __init__(self, profiling_settings):
+        self._enabled = profiling_settings.get("enabled", False)
+        directory = profiling_settings.get("directory", "profiles")
+        self._directory = os.path.join(os.path.dirname(__file__), directory)
+
+    def start(self, request):
+        """
+        Starts profiling if profiling is enabled and the request asks for it
+
+        Parameters:
+            request (flask.Request): the request being handled
+
+        Returns:
+            cProfile.Profile, or None if the request is not profiled
+        """
+        if not self._enabled:
+            return None
+        if request.headers.get(PROFILE_HEADER) != "1" and request.args.get(PROFILE_PARAMETER) != "1":
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def save(self, profile, capture):
+        """
+        Stops a profile and saves it, with the request's input, to the profiling directory
+
+        Parameters:
+            profile (cProfile.Profile): the profile returned by start
+            capture (dict): the space, page, operation, file_text and scenarios of the request
+
+        Returns:
+            str: the path of the saved capture
+        """
+        profile.disable()
+        os.makedirs(self._directory, exist_ok=True)
+        name = "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:8])
+        profile.dump_stats(os.path.join(self._directory, name + ".prof"))
+        capture_path = os.path.join(self._directory, name + ".json")
+        with open(capture_path, 'w') as f:
+            json.dump(capture, f)
+        return capture_path
+
+
+def replay(capture, generator):
+    """
+    Runs a captured request's operation through a code generator
+
+    Parameters:
+        capture (dict): a capture saved by RequestProfiler.save
+        generator (CodeGenerator): the generator to run the operation with
+
+    Returns:
+        str
+    """
+    scenarios = [Scenario.from_dict(x) for x in capture["scenarios"]]
+    if capture["operation"] == "new":
+        return generator.generate_new_scenarios(scenarios)
+    return generator.update_existing_scenarios(scenarios, capture["file_text"] or "")[0]
+
+
+if __name__ == "__main__":
+    from bdd_generator import Catch2CodeGenerator
+
+    parser = argparse.ArgumentParser(description="Replay a captured /generate-data request under cProfile")
+    parser.add_argument("capture", help="a .json capture from the profiling directory")
+    parser.add_argument("--repeat", type=int, default=1, help="times to run the operation")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key")
+    parser.add_argument("--limit", type=int, default=30, help="number of functions to print")
+    parser.add_argument("--output", help="file to save the replay's profile to")
+    args = parser.parse_args()
+
+    with open(args.capture, 'r') as f:
+        capture = json.load(f)
+    if capture.get("scenarios") is None:
+        parser.error("the captured request failed before its scenarios were fetched")
+
+    generator = Catch2CodeGenerator()
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    profile.enable()
+    for _ in range(args.repeat):
+        replay(capture, generator)
+    profile.disable()
+    print("{} {} run(s) in {:.4f}s".format(capture["operation"], args.repeat, time.perf_counter() - start))
+
+    if args.output:
+        profile.dump_stats(args.output)
+    pstats.Stats(profile).sort_stats(args.sort).print_stats(args.limit)
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ScenarioCache():
+    """
+    A bounded, thread safe cache of parsed scenarios. Entries expire after a fixed time to live and, once the cache is
+    full, the least recently used entry is evicted to make room for a new one. Cached values are shared between
+    callers, so they must not be modified
+    """
+
+    def __init__(self, max_entries=128, ttl=300):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Returns the value stored for a key, or None if it is not cached or has expired
+
+        Parameters:
+            key (tuple): the key the value was stored under
+
+        Returns:
+            object
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full
+
+        Parameters:
+            key (tuple): the key to store the value under
+            value (object): the value to store
+        """
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache's size and its hit, miss, eviction and expiration counts
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self._max_entries,
+                "ttl": self._ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class SingleFlight():
+    """
+    Deduplicates concurrent calls for the same key: while a call is in flight, callers with the same key wait for it
+    and share its result, or have its exception raised to them, instead of making the call again
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, function):
+        """
+        Calls a function, or waits for the in flight call with the same key, and returns its result
+
+        Parameters:
+            key (tuple): identifies calls that are interchangeable
+            function (callable): the call to make, taking no arguments
+
+        Returns:
+            object
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call():
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -0,0 +1,23 @@
+from collections import namedtuple
+
+
+class Statement(namedtuple("Statement", ["bdd_type", "text"])):
+    """
+    A BDD statement of a scenario, e.g. Statement("Given", "a user is logged in")
+    """
+    __slots__ = ()
+
+
+class Scenario(namedtuple("Scenario", ["id", "statements"])):
+    """
+    A scenario from a Confluence page: its requirement ID and a tuple of its statements, starting with the SCENARIO
+    statement. Scenarios are immutable, so they can be cached and shared between requests
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return {"id": self.id, "statements": [{"bdd_type": x.bdd_type, "text": x.text} for x in self.statements]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], tuple(Statement(x["bdd_type"], x["text"]) for x in data["statements"]))
@@ -0,0 +1,242 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from scenario_model import Scenario, Statement
+
+# The version of the format written by encode. Bump it when encode changes
+FORMAT_VERSION = 1
+
+
+class ScenarioStore():
+    """
+    A persistent store of parsed scenarios in an SQLite database, keyed by (space, page, page version), so that
+    scenarios fetched before a restart, or by another worker process, are not fetched from Confluence again. Once the
+    stored scenarios take up more than max_bytes, the least recently used pages are evicted. Only the latest version
+    of each page is kept. Database errors are treated as misses, so a broken store never fails a request. Scenarios
+are stored with the version of the parser that produced them, and are all removed when a different version opens
+the store.
+
+    The code generated for a page version can be stored alongside its scenarios, so code generated ahead of time by
+    one worker process is served by all of them. It is removed along with the page's scenarios, and all of it is
+    removed when a different version of the code generator opens the store
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, parser_version=1, generator_version=1):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection is shared by the process's threads. WAL lets worker processes read while another writes
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS scenarios ("
+            "space TEXT NOT NULL, page TEXT NOT NULL, version INTEGER NOT NULL, data BLOB NOT NULL, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (space, page, version))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS scenarios_accessed ON scenarios (accessed)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS rendered ("
+            "space TEXT NOT NULL, page TEXT NOT NULL, version INTEGER NOT NULL, data BLOB NOT NULL, "
+            "size INTEGER NOT NULL, PRIMARY KEY (space, page, version))")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Code is only kept while its scenarios are, so it goes with them
+        self.check_version("scenarios", "{}.{}".format(FORMAT_VERSION, parser_version), ("scenarios", "rendered"))
+        self.check_version("rendered", str(generator_version), ("rendered",))
+
+    def check_version(self, name, version, tables):
+        # Rows written by another version of the code may not decode, or may differ from what this version produces,
+        # so the tables are emptied and marked with this version
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+            if row is None or row[0] != version:
+                for table in tables:
+                    self._connection.execute("DELETE FROM {}".format(table))
+                self._connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, version))
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    def get(self, space, page, version):
+        """
+        Returns the scenarios stored for a page version, or None if they are not stored
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+            version (int): the page's version number
+
+        Returns:
+            list
+        """
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    "SELECT data FROM scenarios WHERE space = ? AND page = ? AND version = ?",
+                    (space, page, version)).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE scenarios SET accessed = ? WHERE space = ? AND page = ? AND version = ?",
+                        (time.time(), space, page, version))
+            except sqlite3.Error:
+                self.errors += 1
+                return None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return self.decode(row[0])
+
+    def put(self, space, page, version, scenarios):
+        """
+        Stores the scenarios of a page version, replacing any other version of the page, then evicts the least
+        recently used pages until the store is within max_bytes
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+            version (int): the page's version number
+            scenarios (list): scenarios from ScenarioGetter.parse_response_data
+        """
+        data = self.encode(scenarios)
+        with self._lock:
+            try:
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    self._connection.execute("DELETE FROM scenarios WHERE space = ? AND page = ?", (space, page))
+                    self._connection.execute("DELETE FROM rendered WHERE space = ? AND page = ? AND version != ?",
+                                             (space, page, version))
+                    self._connection.execute(
+                        "INSERT INTO scenarios (space, page, version, data, size, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                        (space, page, version, data, len(data), time.time()))
+                    self.evict()
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+                self._connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.errors += 1
+
+    def get_rendered(self, space, page, version):
+        """
+        Returns the code stored for a page version, or None if none is stored
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+            version (int): the page's version number
+
+        Returns:
+            str
+        """
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    "SELECT data FROM rendered WHERE space = ? AND page = ? AND version = ?",
+                    (space, page, version)).fetchone()
+            except sqlite3.Error:
+                self.errors += 1
+                return None
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put_rendered(self, space, page, version, code):
+        """
+        Stores the code generated for a page version. It is only kept while the version's scenarios are stored
+
+        Parameters:
+            space (str): the key of a Confluence space
+            page (str): a Confluence page name
+            version (int): the page's version number
+            code (str): the code generated for the page's scenarios
+        """
+        data = zlib.compress(code.encode("utf-8"))
+        with self._lock:
+            try:
+                self._connection.execute("BEGIN IMMEDIATE")
+                try:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO rendered (space, page, version, data, size) "
+                        "SELECT ?, ?, ?, ?, ? WHERE EXISTS "
+                        "(SELECT 1 FROM scenarios WHERE space = ? AND page = ? AND version = ?)",
+                        (space, page, version, data, len(data), space, page, version))
+                    self.evict()
+                except BaseException:
+                    self._connection.execute("ROLLBACK")
+                    raise
+                self._connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.errors += 1
+
+    def evict(self):
+        # Called with the lock held, inside a transaction. A page's stored code counts towards its size
+        total = self._connection.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM scenarios) + (SELECT COALESCE(SUM(size), 0) FROM rendered)"
+        ).fetchone()[0]
+        if total <= self._max_bytes:
+            return
+        for space, page, version, size in self._connection.execute(
+                "SELECT s.space, s.page, s.version, s.size + COALESCE(r.size, 0) FROM scenarios s "
+                "LEFT JOIN rendered r ON r.space = s.space AND r.page = s.page AND r.version = s.version "
+                "ORDER BY s.accessed").fetchall():
+            if total <= self._max_bytes:
+                break
+            for table in ("scenarios", "rendered"):
+                self._connection.execute("DELETE FROM {} WHERE space = ? AND page = ? AND version = ?".format(table),
+                                         (space, page, version))
+            total -= size
+            self.evictions += 1
+
+    def encode(self, scenarios):
+        # Stored as compressed JSON lists rather than pickles, so the store can be read by any version of the code
+        data = [[x.id, [[y.bdd_type, y.text] for y in x.statements]] for x in scenarios]
+        return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    def decode(self, data):
+        return [Scenario(x[0], tuple(Statement(y[0], y[1]) for y in x[1]))
+                for x in json.loads(zlib.decompress(data).decode("utf-8"))]
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM scenarios")
+            self._connection.execute("DELETE FROM rendered")
+
+    def stats(self):
+        """
+        Returns the number of pages stored, the number with generated code stored, their size, and the store's hit,
+        miss, eviction and error counts
+
+        Returns:
+            dict
+        """
+        with self._lock:
+            try:
+                pages, size = self._connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM scenarios").fetchone()
+                rendered, rendered_size = self._connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM rendered").fetchone()
+                size += rendered_size
+            except sqlite3.Error:
+                self.errors += 1
+                pages, rendered, size = 0, 0, 0
+            return {
+                "pages": pages,
+                "rendered": rendered,
+                "bytes": size,
+                "max_bytes": self._max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors
+            }
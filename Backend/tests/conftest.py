@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+# The backend's modules are imported by name, as they are when run from the Backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bdd_generator import Catch2CodeGenerator  # noqa: E402
+from scenario_model import Scenario, Statement  # noqa: E402
+
+
+def make_scenario(scenario_id, *statements):
+    return Scenario(scenario_id, tuple(Statement(bdd_type, text) for bdd_type, text in statements))
+
+
+def with_line_endings(text, line_ending):
+    """
+    Returns text with its line breaks replaced by line_ending, or by alternating "\n" and "\r\n" for "mixed"
+    """
+    if line_ending == "mixed":
+        return ''.join(x + ("\r\n" if i % 2 else "\n") for i, x in enumerate(text.split("\n")))[:-1]
+    return text.replace("\n", line_ending)
+
+
+@pytest.fixture
+def generator():
+    return Catch2CodeGenerator()
+
+
+@pytest.fixture
+def existing_code():
+    return (
+        'SCENARIO("One SC-1", "[SC-1]")\n{\n    GIVEN("a")\n    {\n        THEN("b")\n        {\n        }\n    }\n}\n'
+        'SCENARIO("Two SC-2", "[SC-2]")\n{\n    WHEN("c")\n    {\n    }\n}\n'
+        'SCENARIO("Three SC-3", "[SC-3]")\n{\n    GIVEN("d")\n    {\n    }\n}')
+
+
+@pytest.fixture
+def updated_code():
+    # SC-1 is unchanged, SC-2 has a statement reworded and one added, and SC-4 is not in the file yet
+    return (
+        'SCENARIO("One SC-1", "[SC-1]")\n{\n    GIVEN("a")\n    {\n        THEN("b")\n        {\n        }\n    }\n}\n'
+        'SCENARIO("Two SC-2", "[SC-2]")\n{\n    WHEN("c changed")\n    {\n        THEN("e")\n        {\n        }\n    }\n}\n'
+        'SCENARIO("Three SC-3", "[SC-3]")\n{\n    GIVEN("d")\n    {\n    }\n}\n'
+        'SCENARIO("Four SC-4", "[SC-4]")\n{\n    GIVEN("f")\n    {\n    }\n}')
+
+
+@pytest.fixture
+def scenarios():
+    return [
+        make_scenario("SC-1", ("Scenario", "One"), ("Given", "a"), ("Then", "b")),
+        make_scenario("SC-2", ("Scenario", "Two"), ("When", "c changed"), ("Then", "e")),
+        make_scenario("SC-4", ("Scenario", "Four"), ("Given", "f"))
+    ]
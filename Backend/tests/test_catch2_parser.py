@@ -0,0 +1,84 @@
+"""
+Pins how existing Catch2 files are parsed and updated: the output of an update, which matches the update from before
+files were parsed with Catch2Parser, and the scenario blocks found whatever the file's line endings, whatever braces
+appear in its strings and comments, and when blocks are left unclosed
+"""
+import pytest
+
+from conftest import make_scenario, with_line_endings
+
+BRACES = '''SCENARIO("A { scenario", "[SC-1]")
+{
+    // }
+    /* } { */
+    auto s = "}\\"{";
+    auto r = R"x(} ")x";
+    char c = '}';
+    int n = 1'000;
+    GIVEN("b")
+    {
+        char d = '{';
+    }
+}
+SCENARIO("B", "[SC-2]")
+{
+}
+'''
+
+
+def test_update_output(generator, scenarios, existing_code, updated_code):
+    # The same output as the update before files were parsed with Catch2Parser
+    updated, changed, missing, unchanged = generator.update_existing_scenarios(scenarios, existing_code)
+    assert updated == updated_code
+    assert [x.id for x in changed] == ["SC-2"]
+    assert [x.id for x in missing] == ["SC-4"]
+    assert [x.id for x in unchanged] == ["SC-1"]
+
+
+def test_update_replaces_tabs(generator, scenarios, existing_code, updated_code):
+    updated = generator.update_existing_scenarios(scenarios, existing_code.replace("    ", "\t"))[0]
+    assert updated == updated_code
+
+
+@pytest.mark.parametrize("line_ending", ["\n", "\r\n", "\r", "mixed"])
+def test_update_keeps_line_endings_of_unchanged_code(generator, scenarios, existing_code, updated_code, line_ending):
+    existing = with_line_endings(existing_code, line_ending)
+    updated = generator.update_existing_scenarios(scenarios, existing)[0]
+    first_scenario = existing[:existing.index('SCENARIO("Two')]
+    assert updated.startswith(first_scenario)
+    assert updated.replace("\r\n", "\n").replace("\r", "\n") == updated_code
+
+
+def test_parser_skips_braces_in_literals_and_comments(generator):
+    roots = generator._parser.parse(BRACES)
+    assert [(x.keyword, x.tags) for x in roots] == [("SCENARIO", ["SC-1"]), ("SCENARIO", ["SC-2"])]
+    assert BRACES[roots[0].start:roots[0].end].endswith("    }\n}")
+    assert BRACES[roots[1].start:roots[1].end] == 'SCENARIO("B", "[SC-2]")\n{\n}'
+    assert [x.keyword for x in roots[0].children] == ["GIVEN"]
+
+
+def test_update_with_braces_in_literals_and_comments(generator):
+    scenarios = [make_scenario("SC-2", ("Scenario", "B"), ("Given", "c"))]
+    updated = generator.update_existing_scenarios(scenarios, BRACES)[0]
+    assert updated == (BRACES[:BRACES.index('SCENARIO("B"')] +
+                       'SCENARIO("B SC-2", "[SC-2]")\n{\n    GIVEN("c")\n    {\n    }\n}')
+
+
+@pytest.mark.parametrize("existing", [
+    'SCENARIO("Open", "[SC-1]")\n{\n    GIVEN("a")\n    {\n',
+    'SCENARIO("Open", "[SC-1]")\n{\n    auto s = "unterminated {\n',
+    'SCENARIO("Open", "[SC-1]")\n{\n    /* unterminated comment }\n'
+])
+def test_parser_leaves_unclosed_blocks_open(generator, existing):
+    roots = generator._parser.parse(existing)
+    assert [x.tags for x in roots] == [["SC-1"]]
+    assert roots[0].end is None
+
+
+def test_missing_scenarios_follow_last_closed_scenario(generator):
+    existing = 'SCENARIO("Closed", "[SC-1]")\n{\n}\nSCENARIO("Open", "[SC-2]")\n{\n    GIVEN("a")\n    {\n'
+    scenarios = [make_scenario("SC-3", ("Scenario", "New"), ("Given", "b"))]
+    updated = generator.update_existing_scenarios(scenarios, existing)[0]
+    assert updated == (
+        'SCENARIO("Closed", "[SC-1]")\n{\n}\nSCENARIO("New SC-3", "[SC-3]")\n{\n    GIVEN("b")\n    {\n    }\n}\n\n'
+        'SCENARIO("Open", "[SC-2]")\n{\n    GIVEN("a")\n    {')
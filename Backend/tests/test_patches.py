@@ -0,0 +1,104 @@
+"""
+Pins the changes returned for an update with response=diff: applying the line edits, or the unified diff with
+patch(1), gives the same code as the update itself, whatever the file's line endings
+"""
+import random
+import shutil
+import subprocess
+
+import pytest
+
+import patches
+from bdd_generator import Catch2CodeGenerator
+from conftest import with_line_endings
+from scenario_model import Scenario, Statement
+
+BDD_TYPES = ["Given", "When", "Then", "And_Given", "And_When", "And_Then"]
+
+
+def make_random_scenario(rng, number, version):
+    statements = [Statement("Scenario", "Scenario {} v{}".format(number, version))]
+    statements += [Statement(rng.choice(BDD_TYPES), "step {} v{} {}".format(i, version, rng.randint(0, 2)))
+                   for i in range(rng.randint(0, 4))]
+    return Scenario("SC-{:04d}".format(number), tuple(statements))
+
+
+def generate_cases(count, seed=0):
+    """
+    Yields (scenarios, existing code) update inputs, in which scenarios from the file are kept, changed or dropped,
+    new scenarios are added, and the file is indented with tabs or has code before and after its scenarios
+    """
+    rng = random.Random(seed)
+    generator = Catch2CodeGenerator()
+    for _ in range(count):
+        in_file = [make_random_scenario(rng, i, 0) for i in range(rng.randint(0, 6))]
+        existing = generator.generate_new_scenarios(in_file)
+        if rng.random() < 0.3:
+            existing = existing.replace("    ", "\t", rng.randint(0, 20))
+        if rng.random() < 0.3:
+            existing = "// header\n#include <catch2/catch.hpp>\n\n" + existing + "\n\n// trailer\n"
+
+        scenarios = []
+        for scenario in in_file:
+            r = rng.random()
+            if r < 0.4:
+                scenarios.append(scenario)
+            elif r < 0.8:
+                scenarios.append(make_random_scenario(rng, int(scenario.id[3:]), 1))
+        scenarios += [make_random_scenario(rng, 100 + i, 2) for i in range(rng.randint(0, 3))]
+        rng.shuffle(scenarios)
+        yield scenarios, existing
+
+
+def test_diff_response(generator, scenarios, existing_code, updated_code):
+    changes = generator.diff_existing_scenarios(scenarios, existing_code)
+    assert changes["updated"] == ["SC-2"]
+    assert changes["missing"] == ["SC-4"]
+    assert changes["unchanged"] == ["SC-1"]
+    assert changes["diff"].startswith("--- existing\n+++ updated\n@@ ")
+
+
+def test_unchanged_file_has_no_edits(generator, scenarios, existing_code, updated_code):
+    changes = generator.diff_existing_scenarios(scenarios, updated_code)
+    assert changes["edits"] == []
+    assert changes["diff"] == ""
+    assert generator.update_existing_scenarios(scenarios, updated_code)[0] == updated_code
+
+
+@pytest.mark.parametrize("line_ending", ["\n", "\r\n", "\r", "mixed"])
+def test_edits_give_update_output(generator, line_ending):
+    for scenarios, existing in generate_cases(200):
+        existing = with_line_endings(existing, line_ending)
+        updated = generator.update_existing_scenarios(scenarios, existing)[0]
+        changes = generator.diff_existing_scenarios(scenarios, existing)
+        assert patches.apply_line_edits(existing.splitlines(keepends=True), changes["edits"]) == updated
+
+
+@pytest.mark.skipif(shutil.which("patch") is None, reason="patch is not installed")
+@pytest.mark.parametrize("line_ending", ["\n", "\r\n"])
+def test_diff_applies_with_patch(generator, tmp_path, line_ending):
+    for i, (scenarios, existing) in enumerate(generate_cases(40, seed=1)):
+        existing = with_line_endings(existing, line_ending)
+        changes = generator.diff_existing_scenarios(scenarios, existing)
+        if not changes["diff"]:
+            continue
+        path = tmp_path / "scenarios_{}.cpp".format(i)
+        path.write_bytes(existing.encode("utf-8"))
+        subprocess.run(["patch", "--binary", "--quiet", str(path)], input=changes["diff"].encode("utf-8"), check=True)
+        assert path.read_bytes().decode("utf-8") == generator.update_existing_scenarios(scenarios, existing)[0]
+
+
+def test_line_edits_end_lines_within_the_file():
+    # An edit that joins two lines takes in the rest of the joined line, as a diff line cannot end mid-file
+    lines = ["a\n", "b\n", "c\n", "d\n"]
+    edits = patches.line_edits(lines, lines, [(0, 4, "x")])
+    assert edits == [[0, 3, ["xc\n"]]]
+    assert patches.apply_line_edits(lines, edits) == "xc\nd\n"
+    assert "No newline" not in patches.unified_diff(lines, edits)
+
+
+def test_line_edits_merge_hunks_joined_by_an_unfinished_line():
+    lines = ["a\n", "b\n", "c\n", "d\n"]
+    edits = patches.line_edits(lines, lines, [(1, 2, ""), (2, 3, "y")])
+    assert edits == [[0, 2, ["ay\n"]]]
+    assert patches.apply_line_edits(lines, edits) == "ay\nc\nd\n"
@@ -0,0 +1,60 @@
+"""
+Parsing and verification of Confluence page webhook events. Confluence signs each event with the webhook's secret,
+sending the HMAC-SHA256 of the body in the X-Hub-Signature header as "sha256=<hex digest>"
+"""
+import hashlib
+import hmac
+
+SIGNATURE_HEADER = "X-Hub-Signature"
+
+
+def sign(secret, body):
+    """
+    Returns the signature Confluence sends with a webhook event body
+
+    Parameters:
+        secret (str): the webhook's secret
+        body (bytes): the event body
+
+    Returns:
+        str
+    """
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, body, signature):
+    """
+    Checks an event's signature. No event is accepted when no secret is configured
+
+    Parameters:
+        secret (str): the webhook's secret, or None
+        body (bytes): the event body
+        signature (str): the X-Hub-Signature header sent with the event, or None
+
+    Returns:
+        bool
+    """
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign(secret, body), signature)
+
+
+def parse_page_event(data):
+    """
+    Returns the space key and page name of a page event. Both Confluence's event format, which describes the page
+    under "page", and a plain {"space": ..., "page": ...} object are accepted
+
+    Parameters:
+        data (dict): the event's JSON body
+
+    Returns:
+        tuple: (space, page), or None if the event does not name a page
+    """
+    page = data.get("page")
+    if isinstance(page, dict):
+        space, title = page.get("spaceKey"), page.get("title")
+    else:
+        space, title = data.get("space"), page
+    if not isinstance(space, str) or not isinstance(title, str) or not space or not title:
+        return None
+    return space, title
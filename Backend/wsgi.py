@@ -0,0 +1,8 @@
+"""
+Production entry point. gunicorn imports this module in each worker process:
+
+    gunicorn --config gunicorn.conf.py wsgi:app
+"""
+from bdd_generator import create_app
+
+app = create_app()
@@ -1,14 +1,50 @@
 from flask import Flask, render_template, request
+import gzip
+import json
 import requests
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 
+BACKEND_URL = "http://backend:8002"
+
+# One pooled session is shared by every submission, so connections to the backend are kept alive
+backend = requests.Session()
+backend.mount(BACKEND_URL, HTTPAdapter(pool_connections=1, pool_maxsize=10))
+
+def post_to_backend(path, params):
+    # The body is sent gzip compressed. The session asks for a gzip response and decompresses it
+    body = gzip.compress(json.dumps(params).encode("utf-8"))
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    return backend.post(BACKEND_URL + path, data=body, headers=headers)
+
+def get_backend_error(response):
+    # The backend's own errors are JSON, but werkzeug answers some failures with an HTML page, e.g. the 413 for a body
+    # over max_body_megabytes, as may a proxy in front of the backend
+    if response.headers.get("Content-Type", "").startswith("application/json"):
+        try:
+            error = response.json().get("error")
+        except (ValueError, AttributeError):
+            error = None
+        if error:
+            return error
+    if response.status_code == 413:
+        return "Error: The file is too large to send. Try updating a smaller file."
+    return "Error: The backend could not handle the request (HTTP {}). Try again later.".format(response.status_code)
+
+def forward_to_backend(path):
+    # Passes a request from the generated page's script on to the backend, returning the backend's response as it is
+    response = backend.request(request.method, BACKEND_URL + path)
+    return response.content, response.status_code, {"Content-Type": response.headers.get("Content-Type", "text/plain")}
+
 @app.route('/')
 def load_home():
     return render_template("home.html")
 
 @app.route('/generated', methods=['POST'])
 def get_generated_data():
+    response_mode = None
+    file_text = None
     if request.method=="POST":
         operation = request.form.get("operation").lower()
         if operation == "new":
@@ -20,13 +56,35 @@ def get_generated_data():
             space = request.form.get("space")
             path = request.form.get('path')
             file_text = request.form.get("file_text")
+            response_mode = request.form.get("response")
 
     if operation == "new":
         params = {'operation': operation, 'page': page, 'space': space, 'path': path}
     elif operation == "update":
         params = {'operation': operation, 'page': page, 'space': space, 'file_text':file_text}
-    generated_code = str(requests.get("http://backend:8002/generate-data", params=params).text)
-    return render_template("generated.html", code=generated_code, page=page, space=space, path=path)
+        if response_mode == "diff":
+            params['response'] = "diff"
+
+    # The work runs as a job on the backend, which the generated page polls until it has finished
+    try:
+        submission = post_to_backend("/jobs", params)
+    except requests.RequestException:
+        return render_template("generated.html", code="Error: Could not reach the backend. Try again later.",
+                               page=page, space=space, path=path)
+    if submission.status_code != 202:
+        return render_template("generated.html", code=get_backend_error(submission), page=page, space=space,
+                               path=path)
+    job = submission.json()
+    return render_template("generated.html", code="Generating...", job_id=job["id"], diff=response_mode == "diff",
+                           page=page, space=space, path=path)
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    return forward_to_backend("/jobs/" + job_id)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    return forward_to_backend("/jobs/" + job_id + "/result")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8001)
@@ -0,0 +1,266 @@
+"""
+Drives mixed "new" and "update" traffic at the stack started by docker-compose.yaml and reports the throughput and
+p50/p95/p99 latency reached at each target rate. Requests are sent either to the frontend (port 8001), which submits
+a job to the backend and is then polled for the result like the generated page does, or straight to the backend's
+/generate-data (port 8002).
+
+Requests are started on a fixed schedule whatever the response times, and latency is measured from when each request
+was due to start, so a saturated server shows as growing latency rather than a quietly lower request rate. Updates
+send a file generated from the page by the backend before the run, with some scenarios changed and some removed, so
+file_text has the size of a real file for the page:
+
+    python run_loadtest.py --target backend --rates 10,20,40 --duration 30 --update-fraction 0.5
+"""
+import argparse
+import gzip
+import http.client
+import json
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+JOB_ID_PATTERN = re.compile(r'/jobs/([0-9a-f]+)')
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+
+class HttpClient():
+    """
+    Sends requests over one kept-alive connection per thread, reconnecting after errors
+    """
+
+    def __init__(self, url, timeout=120):
+        parts = urlsplit(url)
+        self._host = parts.hostname
+        self._port = parts.port
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Returns the status and decompressed body of a response
+
+        Returns:
+            tuple
+        """
+        headers = dict(headers or {}, **{"Accept-Encoding": "gzip"})
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self._host, self._port,
+                                                                             timeout=self._timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+        if response.getheader("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return response.status, data
+
+
+def make_update_file(new_file, changed=0.1, missing=0.1, seed=0):
+    """
+    Turns the file generated for a page into an out of date copy of it, with the text of some scenarios changed and
+    some scenarios removed, so that updating it does the work a real update would
+
+    Parameters:
+        new_file (str): the output of a "new" request
+        changed (float): fraction of scenarios whose text is changed
+        missing (float): fraction of scenarios removed
+
+    Returns:
+        str
+    """
+    chooser = random.Random(seed)
+    blocks = []
+    for block in re.split(r'\n(?=SCENARIO\()', new_file):
+        roll = chooser.random()
+        if roll < missing:
+            continue
+        if roll < missing + changed:
+            block = block.replace(" statement ", " outdated statement ")
+        blocks.append(block)
+    return "\n".join(blocks)
+
+
+def backend_request(client, operation, space, page, file_text):
+    params = {"operation": operation, "space": space, "page": page}
+    if operation == "update":
+        params["file_text"] = file_text
+    # The body is gzip compressed as the frontend sends it
+    body = gzip.compress(json.dumps(params).encode("utf-8"))
+    status, data = client.request("POST", "/generate-data", body,
+                                  {"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    if status != 200 or data.startswith(b"Error:"):
+        raise RuntimeError("{}: {}".format(status, data[:200].decode("utf-8", "replace")))
+
+
+def frontend_request(client, operation, space, page, file_text, poll_interval):
+    form = {"operation": operation, "space": space, "page": page, "path": ""}
+    if operation == "update":
+        form["file_text"] = file_text
+    status, data = client.request("POST", "/generated", urlencode(form),
+                                  {"Content-Type": "application/x-www-form-urlencoded"})
+    match = JOB_ID_PATTERN.search(data.decode("utf-8", "replace"))
+    if status != 200 or match is None:
+        raise RuntimeError("{}: job was not submitted".format(status))
+
+    job_path = "/jobs/" + match.group(1)
+    while True:
+        status, data = client.request("GET", job_path)
+        if status != 200:
+            raise RuntimeError("{}: {}".format(status, data[:200].decode("utf-8", "replace")))
+        if json.loads(data)["status"] in FINISHED_STATES:
+            break
+        time.sleep(poll_interval)
+    status, data = client.request("GET", job_path + "/result")
+    if status != 200 or data.startswith(b'{"error"'):
+        raise RuntimeError("{}: {}".format(status, data[:200].decode("utf-8", "replace")))
+
+
+def percentile(values, fraction):
+    # values must be sorted
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarise(samples, duration):
+    """
+    Returns the throughput, error count and latency percentiles, in milliseconds, of a set of requests
+
+    Parameters:
+        samples (list): (latency in seconds, error or None) tuples
+        duration (float): seconds taken to complete the requests
+
+    Returns:
+        dict
+    """
+    latencies = sorted(round(x[0] * 1000, 2) for x in samples if x[1] is None)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(latencies),
+        "throughput": round(len(latencies) / duration, 2) if duration else None,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1] if latencies else None
+    }
+
+
+def run_step(send, rate, duration, update_fraction, pages, concurrency, seed=0):
+    """
+    Starts requests at a fixed rate for a duration, then waits for them to finish
+
+    Parameters:
+        send (function): sends one request, taking an operation and page name
+        rate (float): requests started per second
+        duration (float): seconds to start requests for
+        update_fraction (float): fraction of the requests that are updates
+        pages (list): page names, chosen between at random
+        concurrency (int): most requests in flight at once
+
+    Returns:
+        dict: the results of all requests and of each operation
+    """
+    chooser = random.Random(seed)
+    samples = {"new": [], "update": []}
+    lock = threading.Lock()
+
+    def run(operation, page, due):
+        error = None
+        try:
+            send(operation, page)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        latency = time.perf_counter() - due
+        with lock:
+            samples[operation].append((latency, error))
+        return error
+
+    start = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+        for i in range(int(rate * duration)):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            operation = "update" if chooser.random() < update_fraction else "new"
+            futures.append(executor.submit(run, operation, chooser.choice(pages), due))
+    elapsed = time.perf_counter() - start
+
+    errors = [x.result() for x in futures if x.result() is not None]
+    result = {"target_rate": rate, "elapsed": round(elapsed, 2)}
+    result.update(summarise(samples["new"] + samples["update"], elapsed))
+    result["operations"] = {x: summarise(samples[x], elapsed) for x in samples}
+    result["sample_errors"] = sorted(set(errors))[:5]
+    return result
+
+
+def format_ms(value):
+    return "-" if value is None else "{:.1f}".format(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the frontend and backend with mixed new and update traffic")
+    parser.add_argument("--target", choices=("frontend", "backend"), default="frontend",
+                        help="send requests to the frontend, which runs them as backend jobs, or to the backend")
+    parser.add_argument("--frontend-url", default="http://localhost:8001")
+    parser.add_argument("--backend-url", default="http://localhost:8002")
+    parser.add_argument("--rates", default="5,10,20", help="comma separated target requests per second, run in turn")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run each rate for")
+    parser.add_argument("--update-fraction", type=float, default=0.5, help="fraction of requests that are updates")
+    parser.add_argument("--space", default="LOAD", help="space key sent with every request")
+    parser.add_argument("--pages", type=int, default=20, help="distinct page names to spread requests over")
+    parser.add_argument("--concurrency", type=int, default=64, help="most requests in flight at once")
+    parser.add_argument("--changed", type=float, default=0.1, help="fraction of scenarios changed in update files")
+    parser.add_argument("--missing", type=float, default=0.1, help="fraction of scenarios missing from update files")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between polls of frontend jobs")
+    parser.add_argument("--output", help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    backend = HttpClient(args.backend_url)
+    pages = ["Load test page {}".format(i) for i in range(1, args.pages + 1)]
+
+    # Every page of the mock server holds the same requirements, so one file serves as the update input for all
+    status, new_file = backend.request("GET", "/generate-data?" + urlencode(
+        {"operation": "new", "space": args.space, "page": pages[0]}))
+    if status != 200 or new_file.startswith(b"Error:"):
+        sys.exit("Could not generate the update file: {} {}".format(status, new_file[:200].decode("utf-8", "replace")))
+    file_text = make_update_file(new_file.decode("utf-8"), args.changed, args.missing)
+    print("Update file: {} bytes, {} scenarios".format(len(file_text), file_text.count("SCENARIO(")), file=sys.stderr)
+
+    if args.target == "frontend":
+        frontend = HttpClient(args.frontend_url)
+
+        def send(operation, page):
+            frontend_request(frontend, operation, args.space, page, file_text, args.poll_interval)
+    else:
+        def send(operation, page):
+            backend_request(backend, operation, args.space, page, file_text)
+
+    results = []
+    print("{:>8} {:>10} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+        "rate", "throughput", "requests", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for rate in [float(x) for x in args.rates.split(",")]:
+        result = run_step(send, rate, args.duration, args.update_fraction, pages, args.concurrency)
+        results.append(result)
+        rows = [("all", result)] + sorted(result["operations"].items())
+        for name, row in rows:
+            print("{:>8} {:>10} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+                "{:g}".format(rate) if name == "all" else "  " + name, row["throughput"], row["requests"],
+                row["errors"], format_ms(row["p50_ms"]), format_ms(row["p95_ms"]), format_ms(row["p99_ms"]),
+                format_ms(row["max_ms"])))
+        for error in result["sample_errors"]:
+            print("  error: " + error, file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"target": args.target, "update_file_bytes": len(file_text), "results": results}, f, indent=4)